@@ -30,6 +30,7 @@ import traceback
 
 from oslo_config import cfg
 
+from glance.api import sios_client
 from glance.common import exception
 from oslo_log import log as logging
 
@@ -44,6 +45,7 @@ opts = [
     cfg.IntOpt('keystone_auth_port', default=35357),
     cfg.StrOpt('sios_auth_host', default='127.0.0.1'),
     cfg.IntOpt('sios_auth_port', default=5253),
+    cfg.StrOpt('sios_unix_socket', default=None),
     cfg.StrOpt('auth_protocol', default='http'),
     cfg.StrOpt('auth_version', default=None),
     cfg.BoolOpt('delay_auth_decision', default=False),
@@ -119,6 +121,9 @@ class Enforcer(object):
         else:
         	self.http_client_class = httplib.HTTPSConnection
 
+        # NOTE: The policy snapshots are downloaded with the admin token.
+        sios_client.set_token_source('glance', self.get_admin_token)
+
     def _conf_get(self, name):
         return CONF.authtoken[name]
 
@@ -156,46 +161,29 @@ class Enforcer(object):
             datetime_expiry = timeutils.parse_isotime(expiry)
             return (token, timeutils.normalize_time(datetime_expiry))
         except (AssertionError, KeyError):
-            self.LOG.warn(
+            LOG.warn(
                 "Unexpected response from keystone service: %s", data)
-            raise ServiceError('invalid json response')
+            raise sios_client.ServiceError('invalid json response')
         except (ValueError):
-            self.LOG.warn(
+            LOG.warn(
                 "Unable to parse expiration time from token: %s", data)
-            raise ServiceError('invalid json response')
+            raise sios_client.ServiceError('invalid json response')
 
     def get_admin_token(self):
-        """Return admin token, possibly fetching a new one.
+        """Return admin token, refreshed in the background.
 
-        if self.admin_token_expiry is set from fetching an admin token, check
-        it for expiration, and request a new token is the existing token
-        is about to expire.
+        The token is shared by every policy shim of the process. The first
+        call waits for it to be fetched, then a background greenthread
+        refreshes it before it expires.
 
         :return admin token id
-        :raise ServiceError when unable to retrieve token from keystone
+        :raises ServiceError when unable to fetch a token from keystone
 
         """
-        if self.admin_token_expiry:
-            if will_expire_soon(self.admin_token_expiry):
-                self.admin_token = None
-
-        if not self.admin_token:
-            (self.admin_token,
-             self.admin_token_expiry) = self._request_admin_token()
-
-        return self.admin_token
-
-    def _get_http_connection(self, auth_host, auth_port):
-        if self.auth_protocol == 'http':
-            return self.http_client_class(auth_host, auth_port,
-                                          timeout=self.http_connect_timeout)
-        else:
-            return self.http_client_class(auth_host,
-                                          auth_port,
-                                          self.key_file,
-                                          self.cert_file,
-                                          timeout=self.http_connect_timeout)
-
+        key = (self.keystone_auth_host, self.keystone_auth_port,
+               self.admin_user, self.admin_tenant_name)
+        return sios_client.get_client().admin_token(key,
+                                                    self._request_admin_token)
 
     def _http_request(self, auth_host, auth_port, method, path, **kwargs):
         """HTTP request helper used to make unspecified content type requests.
@@ -203,31 +191,11 @@ class Enforcer(object):
         :param method: http method
         :param path: relative request url
         :return (http response object, response body)
-        :raise ServerError when unable to communicate with keystone
+        :raise ServiceError when unable to communicate with keystone
 
         """
-        conn = self._get_http_connection(auth_host, auth_port)
-        RETRIES = 3
-        retry = 0
-
-        while True:
-            try:
-                conn.request(method, path, **kwargs)
-                response = conn.getresponse()
-                body = response.read()
-                break
-            except Exception as e:
-                if retry == RETRIES:
-                    self.LOG.error('HTTP connection exception: %s' % e)
-                    raise ServiceError('Unable to communicate with keystone')
-                # NOTE(vish): sleep 0.5, 1, 2
-                self.LOG.warn('Retrying on HTTP connection exception: %s' % e)
-                time.sleep(2.0 ** retry / 2)
-                retry += 1
-            finally:
-                conn.close()
-
-        return response, body
+        return sios_client.get_client().http_request(auth_host, auth_port,
+                                                     method, path, **kwargs)
 
     def _json_request(self, auth_host, auth_port, method, path, body=None, additional_headers=None):
         """HTTP request helper used to make json requests.
@@ -260,11 +228,54 @@ class Enforcer(object):
         try:
             data = jsonutils.loads(body)
         except ValueError:
-            self.LOG.debug('Keystone did not return json-encoded body')
+            LOG.debug('Keystone did not return json-encoded body')
             data = {}
 
         return response, data
 
+    def flush_cache(self):
+        """Forget the decisions of SIOS cached in this process."""
+        sios_client.flush_cache()
+
+    def _token(self, context, mode):
+        if mode == 'check':
+            return context.auth_tok
+        return context.auth_token
+
+    def prefetch(self, context, actions, target=None, mode='enforce'):
+        """Asks SIOS at once for the decisions of actions about to be checked.
+
+           Later calls to check() or enforce() with the same context, action
+           and target are answered from the prefetched decisions.
+
+           :param context: Glance request context
+           :param actions: Strings representing the actions to be checked
+           :param target: Dictionary representing the object of the actions.
+           :param mode: 'enforce' or 'check', the method to be called later.
+        """
+        identity = (context.user, context.tenant, context.roles)
+        sios_client.get_client().prefetch(context, 'glance', mode,
+                                          self._token(context, mode),
+                                          [(action, target or {})
+                                           for action in actions],
+                                          identity)
+
+    def defer(self, context, action, target=None, mode='enforce'):
+        """Registers a check whose decision is not needed yet.
+
+           It is sent to SIOS along with the next check of the context that
+           SIOS has to answer, then check() or enforce() answers it without
+           SIOS.
+
+           :param context: Glance request context
+           :param action: String representing the action to be checked
+           :param target: Dictionary representing the object of the action.
+           :param mode: 'enforce' or 'check', the method to be called later.
+        """
+        sios_client.get_client().defer(context, 'glance', mode,
+                                       self._token(context, mode), action,
+                                       target or {})
+
     def check_is_admin(self, context):
         """Check if the given context is associated with an admin role,
            as defined via the 'context_is_admin' RBAC rule.
@@ -285,10 +296,11 @@ class Enforcer(object):
         """
         if (context.auth_tok == None):
 	  return False
-        headers = {'X-Auth-Token': context.auth_tok, 'X-Action': action, 'X-Target': target}
-        response, data = self._json_request(self.sios_auth_host, self.sios_auth_port, 'POST',
-                                            '/v1/pdp/check_glance', additional_headers=headers)
-	return data
+        identity = (context.user, context.tenant, context.roles)
+        return sios_client.get_client().decide('glance', 'check',
+                                               context.auth_tok, action,
+                                               target, identity,
+                                               scope=context)
 
     def enforce(self, context, action, target):
         """Verifies that the action is valid on the target in this context.
@@ -299,9 +311,11 @@ class Enforcer(object):
            :raises: `glance.common.exception.Forbidden`
            :returns: A non-False value if access is allowed.
         """
-        headers = {'X-Auth-Token': context.auth_token, 'X-Action': action, 'X-Target': target}
-        response, data = self._json_request(self.sios_auth_host, self.sios_auth_port, 'POST',
-                                            '/v1/pdp/enforce_glance', additional_headers=headers)
+        identity = (context.user, context.tenant, context.roles)
+        data = sios_client.get_client().decide('glance', 'enforce',
+                                               context.auth_token, action,
+                                               target, identity,
+                                               scope=context)
 	if (data == False):
 	  raise exception.Forbidden
         else:
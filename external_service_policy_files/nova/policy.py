@@ -34,6 +34,7 @@ import os.path
 
 from nova import exception
 from nova.openstack.common import policy
+from nova import sios_client
 from nova import utils
 
 from oslo_serialization import jsonutils
@@ -47,6 +48,7 @@ opts = [
     cfg.IntOpt('keystone_auth_port', default=35357),
     cfg.StrOpt('sios_auth_host', default='127.0.0.1'),
     cfg.IntOpt('sios_auth_port', default=5253),
+    cfg.StrOpt('sios_unix_socket', default=None),
     cfg.StrOpt('auth_protocol', default='http'),
     cfg.StrOpt('auth_version', default=None),
     cfg.BoolOpt('delay_auth_decision', default=False),
@@ -75,6 +77,7 @@ def reset():
     if _ENFORCER:
         _ENFORCER.clear()
         _ENFORCER = None
+    sios_client.flush_cache()
 
 def init(policy_file=None, rules=None, default_rule=None, use_conf=True):
     """Init an Enforcer class.
@@ -148,15 +151,49 @@ def enforce(context, action, target, do_raise=True):
            :returns: A non-False value if access is allowed.
         """
 
-        headers = {'X-Auth-Token': context.auth_token, 'X-Action': action, 'X-Target': target}
-	req = RESTConnect()
-        response, data = req._json_request(sios_auth_host, sios_auth_port, 'POST', 
-	                                    '/v1/pdp/enforce_nova', additional_headers=headers)
+        identity = (context.user_id, context.project_id, context.roles)
+        data = sios_client.get_client().decide('nova', 'enforce',
+                                               context.auth_token, action,
+                                               target, identity,
+                                               scope=context)
         if (data == False):
           raise exception.PolicyNotAuthorized
         else:
           return data
 
+def prefetch(context, actions, target=None):
+        """Asks SIOS at once for the decisions of actions about to be enforced.
+
+           Later calls to enforce() with the same context, action and target
+           are answered from the prefetched decisions.
+
+           :param context: Nova request context
+           :param actions: Strings representing the actions to be checked
+           :param target: Dictionary representing the object of the actions.
+        """
+
+        identity = (context.user_id, context.project_id, context.roles)
+        sios_client.get_client().prefetch(context, 'nova', 'enforce',
+                                          context.auth_token,
+                                          [(action, target or {})
+                                           for action in actions],
+                                          identity)
+
+def defer(context, action, target=None):
+        """Registers a check whose decision is not needed yet.
+
+           It is sent to SIOS along with the next check of the context that
+           SIOS has to answer, then enforce() answers it without SIOS.
+
+           :param context: Nova request context
+           :param action: String representing the action to be checked
+           :param target: Dictionary representing the object of the action.
+        """
+
+        sios_client.get_client().defer(context, 'nova', 'enforce',
+                                       context.auth_token, action,
+                                       target or {})
+
 class RESTConnect(object):
     def __init__(self):
             # where to find the auth service (we use this to validate tokens)
@@ -249,44 +286,27 @@ class RESTConnect(object):
             except (AssertionError, KeyError):
                 LOG.warn(
                     "Unexpected response from keystone service: %s", data)
-                raise ServiceError('invalid json response')
+                raise sios_client.ServiceError('invalid json response')
             except (ValueError):
                 LOG.warn(
                     "Unable to parse expiration time from token: %s", data)
-                raise ServiceError('invalid json response')
+                raise sios_client.ServiceError('invalid json response')
     
     def get_admin_token(self):
-            """Return admin token, possibly fetching a new one.
+            """Return admin token, refreshed in the background.
     
-            if self.admin_token_expiry is set from fetching an admin token, check
-            it for expiration, and request a new token is the existing token
-            is about to expire.
+            The token is shared by every policy shim of the process. The
+            first call waits for it to be fetched, then a background
+            greenthread refreshes it before it expires.
     
             :return admin token id
-            :raise ServiceError when unable to retrieve token from keystone
+            :raises ServiceError when unable to fetch a token from keystone
     
             """
-            if self.admin_token_expiry:
-                if will_expire_soon(self.admin_token_expiry):
-                    self.admin_token = None
-    
-            if not self.admin_token:
-                (self.admin_token,
-                 self.admin_token_expiry) = self._request_admin_token()
-    
-            return self.admin_token
-    
-    def _get_http_connection(self, auth_host, auth_port):
-            if self.auth_protocol == 'http':
-                return self.http_client_class(auth_host, auth_port,
-                                              timeout=self.http_connect_timeout)
-            else:
-                return self.http_client_class(auth_host,
-                                              auth_port,
-                                              self.key_file,
-                                              self.cert_file,
-                                              timeout=self.http_connect_timeout)
-    
+            key = (self.keystone_auth_host, self.keystone_auth_port,
+                   self.admin_user, self.admin_tenant_name)
+            return sios_client.get_client().admin_token(
+                key, self._request_admin_token)
     
     def _http_request(self, auth_host, auth_port, method, path, **kwargs):
             """HTTP request helper used to make unspecified content type requests.
@@ -294,31 +314,12 @@ class RESTConnect(object):
             :param method: http method
             :param path: relative request url
             :return (http response object, response body)
-            :raise ServerError when unable to communicate with keystone
+            :raise ServiceError when unable to communicate with keystone
     
             """
-            conn = self._get_http_connection(auth_host, auth_port)
-            RETRIES = 3
-            retry = 0
-    
-            while True:
-                try:
-                    conn.request(method, path, **kwargs)
-                    response = conn.getresponse()
-                    body = response.read()
-                    break
-                except Exception as e:
-                    if retry == RETRIES:
-                        LOG.error('HTTP connection exception: %s' % e)
-                        raise ServiceError('Unable to communicate with keystone')
-                    # NOTE(vish): sleep 0.5, 1, 2
-                    LOG.warn('Retrying on HTTP connection exception: %s' % e)
-                    time.sleep(2.0 ** retry / 2)
-                    retry += 1
-                finally:
-                    conn.close()
-    
-            return response, body
+            return sios_client.get_client().http_request(auth_host, auth_port,
+                                                         method, path,
+                                                         **kwargs)
     
     def _json_request(self, auth_host, auth_port, method, path, body=None, additional_headers=None):
             """HTTP request helper used to make json requests.
@@ -356,3 +357,8 @@ class RESTConnect(object):
     
             return response, data
  
+
+# NOTE: The policy snapshots are downloaded with the admin token; the
+# connection is set up on first use, once the configuration is loaded.
+sios_client.set_token_source('nova',
+                             lambda: RESTConnect().get_admin_token())
@@ -0,0 +1,1283 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""HTTP client shared by the SIOS policy shims of nova and glance.
+
+One client serves every shim of a process. It keeps a pool of persistent
+HTTP/1.1 connections per endpoint, caches the DNS resolution of the
+endpoints, and backs off between retries with eventlet.sleep, so that a
+retrying greenthread does not stall the others.
+
+Decisions are cached in the process for a few seconds, keyed on the token,
+the action and the target, so that repeated checks within an API request
+cost a dict lookup. A Cache-Control header on a decision of SIOS overrides
+the configured lifetime. Greenthreads asking for a decision that is already
+being requested wait for its result instead of sending the same request.
+Optionally, an expired decision is still served for a grace period while a
+single background request refreshes it, so that an outage of SIOS does not
+stall the API requests; past that period, decisions fail at once while every
+SIOS endpoint is ejected.
+
+Requests to SIOS are spread over its endpoints, each one going to the
+endpoint with the fewest outstanding requests. Alternatively, decisions may
+be routed on a consistent hash of the credentials of the caller, so that each
+SIOS node keeps serving the same callers and its caches stay warm; a node
+already carrying more than its share of the outstanding requests passes its
+callers on to the next node of the ring. An endpoint is ejected for a
+while after consecutive failures, or for the time a Retry-After header of an
+overloaded endpoint asks, and endpoints are checked in the background so that
+recovered ones are readmitted early. A decision request may be hedged: if no
+answer came after a delay, the same request is sent to another endpoint and
+the first answer wins.
+
+The shims download the policy snapshots with their admin token. It is
+fetched from keystone on first use, then refreshed before it expires by a
+background greenthread shared by every shim of the process.
+
+Within one API request, the shims may prefetch the decisions they are about
+to need, or defer checks whose answer is not needed yet, so that the checks
+of the request go to SIOS together in calls to its batch endpoint. Later
+checks of the request are answered from the prefetched decisions.
+
+Optionally, decisions are evaluated in the process, with a snapshot of the
+policy of the service published by SIOS and polled with conditional requests
+in the background. SIOS is still asked for the decisions the snapshot cannot
+make, such as those depending on http checks, and until the first snapshot
+has been downloaded.
+
+The client counts its requests, retries, timeouts, cache hits and coalesced
+requests, and keeps latency histograms per action and per SIOS endpoint.
+get_stats() returns them, and they may also be logged periodically.
+
+Install this module next to the policy.py of the service, as
+nova/sios_client.py or glance/api/sios_client.py.
+"""
+
+import bisect
+import calendar
+import collections
+import email.utils
+import hashlib
+import httplib
+import logging
+import math
+import os
+import random
+import socket
+import time
+import weakref
+
+import eventlet
+from eventlet import event
+from eventlet import queue
+from eventlet import semaphore
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+
+LOG = logging.getLogger(__name__)
+
+opts = [
+    cfg.IntOpt('sios_pool_size', default=10,
+               help='Number of idle connections kept open to each endpoint.'),
+    cfg.FloatOpt('sios_timeout', default=5.0,
+                 help='Timeout, in seconds, of the socket operations of a '
+                      'request to SIOS or keystone.'),
+    cfg.IntOpt('sios_retries', default=3,
+               help='Number of times a failed request is retried.'),
+    cfg.FloatOpt('sios_retry_delay', default=0.5,
+                 help='Seconds to wait before the first retry of a failed '
+                      'request. The delay doubles with every retry.'),
+    cfg.IntOpt('sios_dns_cache_time', default=300,
+               help='Number of seconds the addresses of an endpoint are '
+                    'cached.'),
+    cfg.IntOpt('sios_cache_size', default=1000,
+               help='Number of decisions cached in the process. Set to 0 '
+                    'to disable the decision cache.'),
+    cfg.IntOpt('sios_cache_time', default=5,
+               help='Number of seconds a decision is cached, unless SIOS '
+                    'sets another lifetime.'),
+    cfg.IntOpt('sios_stale_time', default=0,
+               help='Number of seconds past its lifetime a cached decision '
+                    'is still served, while a single request refreshes it '
+                    'in the background. Decisions that cannot be served '
+                    'from the cache then fail at once while every SIOS '
+                    'endpoint is ejected, instead of being retried, and a '
+                    'request is tried once per endpoint without backoff, '
+                    'its failed endpoints being ejected. Set to 0 to '
+                    'disable.'),
+    cfg.BoolOpt('sios_coalesce', default=True,
+                help='Send only one request at a time for identical '
+                     'decisions, and share its result between the '
+                     'greenthreads waiting for it.'),
+    cfg.ListOpt('sios_endpoints', default=[],
+                help='SIOS endpoints, as host:port or as the path of a Unix '
+                     'domain socket. Defaults to sios_unix_socket if set, '
+                     'else to sios_auth_host:sios_auth_port.'),
+    cfg.IntOpt('sios_eject_failures', default=3,
+               help='Number of consecutive failures after which a SIOS '
+                    'endpoint is ejected.'),
+    cfg.IntOpt('sios_eject_time', default=30,
+               help='Number of seconds a failing SIOS endpoint is ejected '
+                    'for. Ejected endpoints are only used when no other '
+                    'is available.'),
+    cfg.IntOpt('sios_health_check_interval', default=10,
+               help='Number of seconds between two health checks of the '
+                    'SIOS endpoints. Set to 0 to disable the checks.'),
+    cfg.StrOpt('sios_routing', default='least_outstanding',
+               choices=('least_outstanding', 'consistent_hash'),
+               help='How decision requests are routed to the SIOS '
+                    'endpoints: to the one with the fewest outstanding '
+                    'requests, or on a consistent hash of the user, tenant '
+                    'and roles of the caller.'),
+    cfg.FloatOpt('sios_hash_load_factor', default=1.25,
+                 help='With consistent hash routing, how many times its '
+                      'share of the outstanding requests an endpoint may '
+                      'carry before requests spill over to the next '
+                      'endpoint of the ring.'),
+    cfg.IntOpt('sios_token_refresh_margin', default=300,
+               help='Number of seconds before its expiry the admin token '
+                    'is refreshed.'),
+    cfg.IntOpt('sios_stats_interval', default=0,
+               help='Number of seconds between two logs of the statistics '
+                    'of the SIOS client. Set to 0 to disable the logs.'),
+    cfg.IntOpt('sios_batch_size', default=100,
+               help='Maximum number of decisions asked to SIOS in one call '
+                    'to its batch endpoint. It must not exceed the '
+                    'max_batch_size of SIOS.'),
+    cfg.BoolOpt('sios_local_policy', default=False,
+                help='Evaluate the decisions in the process with a snapshot '
+                     'of the policy of the service downloaded from SIOS. '
+                     'SIOS is still asked for the decisions the snapshot '
+                     'cannot make.'),
+    cfg.IntOpt('sios_snapshot_interval', default=30,
+               help='Number of seconds between two checks for a new policy '
+                    'snapshot on SIOS, made with conditional requests.'),
+    cfg.FloatOpt('sios_hedge_delay', default=0.0,
+                 help='Seconds after which a decision request still '
+                      'unanswered is also sent to another SIOS endpoint. '
+                      'Set to 0 to disable hedged requests.'),
+]
+CONF = cfg.CONF
+CONF.register_opts(opts, group='authtoken')
+
+JSON_HEADERS = {
+    'Content-type': 'application/json',
+    'Accept': 'application/json',
+}
+
+MISSING = object()
+
+# NOTE: Upper bounds of the histogram buckets, in seconds, four per power of
+# two from about a microsecond to a minute as on the SIOS server.
+BUCKETS = tuple(m * 2.0 ** e for e in range(-20, 6)
+                for m in (1.0, 1.25, 1.5, 1.75))
+
+
+class ServiceError(Exception):
+    """The SIOS or keystone service could not be reached, or failed."""
+
+
+class Unsupported(Exception):
+    """A decision needs a check only SIOS can evaluate."""
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection to a SIOS server listening on a Unix domain socket"""
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.unix_socket = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_socket)
+        self.sock = sock
+
+
+class LocalPolicy(object):
+    """A snapshot of the policy of a service, evaluated in the process.
+
+    It decides like the oslo.policy interpreter of SIOS does. See
+    sios.api.policy_snapshot for the format of the snapshots.
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot['version']
+        self.rules = snapshot['rules']
+        self.default = snapshot['default']
+
+    def decide(self, action, target, creds):
+        """Return whether an action is allowed on a target.
+
+        :param creds: dict with the user, tenant and roles of the caller
+        :raise Unsupported when only SIOS can decide
+        """
+        node = self.rules.get(action, self.default)
+        return bool(self._evaluate(node, target, creds, []))
+
+    def _evaluate(self, node, target, creds, stack):
+        if node is True or node is False:
+            return node
+        kind = node[0]
+        if kind == 'not':
+            return not self._evaluate(node[1], target, creds, stack)
+        if kind in ('and', 'or'):
+            # NOTE: Stop at the first False of an and, or the first True of
+            # an or, as the interpreter does; checks after it may be
+            # unsupported.
+            stop = kind == 'or'
+            for child in node[1:]:
+                if self._evaluate(child, target, creds, stack) is stop:
+                    return stop
+            return not stop
+        if kind == 'rule':
+            name = node[1]
+            if name in stack:
+                raise Unsupported('Reference cycle through rule %s' % name)
+            stack.append(name)
+            try:
+                return self._evaluate(self.rules[name], target, creds, stack)
+            finally:
+                stack.pop()
+        if kind == 'role':
+            return node[1] in [role.lower() for role in creds['roles']]
+        if kind == 'generic':
+            return self._generic(node[1], node[2], target, creds)
+        raise Unsupported('Unsupported check %s' % (node,))
+
+    def _generic(self, left, match, target, creds):
+        try:
+            value = match % target
+        except KeyError:
+            return False
+        except (TypeError, ValueError):
+            raise Unsupported('Cannot format %s with the target' % match)
+        if 'literal' in left:
+            return value == left['literal']
+        leftval = creds
+        try:
+            for key in left['path']:
+                leftval = leftval[key]
+        except KeyError:
+            return False
+        except TypeError:
+            raise Unsupported('Unsupported credentials path %s' % left)
+        return value == unicode(leftval)
+
+
+class Batch(object):
+    """The decisions prefetched and the checks deferred for a scope."""
+
+    def __init__(self):
+        self.decisions = {}
+        self.deferred = collections.OrderedDict()
+
+
+class Histogram(object):
+    """A distribution of durations."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding a quantile."""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean': self.total / self.count,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': self.max}
+
+
+class Stats(object):
+    """Counters and latency histograms of the client.
+
+    Recording does not yield to the eventlet hub, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.actions = collections.defaultdict(Histogram)
+        self.endpoints = collections.defaultdict(Histogram)
+        self.endpoint_counters = collections.defaultdict(
+            lambda: collections.defaultdict(int))
+
+    def inc(self, name, endpoint=None):
+        """Count an event, for an endpoint if given."""
+        self.counters[name] += 1
+        if endpoint is not None:
+            self.endpoint_counters[endpoint][name] += 1
+
+    def snapshot(self):
+        """Return the statistics as a JSON serializable dict."""
+        endpoints = {}
+        for name, histogram in self.endpoints.items():
+            endpoints[name] = histogram.summary()
+        for name, counters in self.endpoint_counters.items():
+            endpoints.setdefault(name, {'count': 0}).update(counters)
+        return {'counters': dict(self.counters),
+                'actions': dict((action, histogram.summary())
+                                for action, histogram
+                                in self.actions.items()),
+                'endpoints': endpoints}
+
+
+class DecisionCache(object):
+    """LRU cache of decisions, each expiring after its own lifetime."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, key, grace=0):
+        """Return the cached (decision, expiry) of a key, or (MISSING, 0).
+
+        Decisions expired for less than grace seconds are still returned.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None or entry[0] + grace <= time.time():
+            return MISSING, 0
+        self.entries[key] = entry
+        return entry[1], entry[0]
+
+    def set(self, key, value, ttl):
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        self.entries[key] = (time.time() + ttl, value)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def canonical_target(target):
+    """Return a string identifying a target whatever the order of its keys."""
+    try:
+        return jsonutils.dumps(target, sort_keys=True)
+    except (TypeError, ValueError):
+        return repr(target)
+
+
+def encode_target(target):
+    """Return a target the way SIOS receives it, encoded in JSON."""
+    return jsonutils.dumps(target or {})
+
+
+def cache_lifetime(response, default):
+    """Return how many seconds a response may be cached.
+
+    The max-age of a Cache-Control header of the response takes precedence
+    over the default, and no-cache or no-store prevent caching.
+    """
+    header = response.getheader('cache-control')
+    if not header:
+        return default
+    for directive in header.split(','):
+        directive = directive.strip().lower()
+        if directive in ('no-cache', 'no-store'):
+            return 0
+        if directive.startswith('max-age='):
+            try:
+                return int(directive[len('max-age='):])
+            except ValueError:
+                return 0
+    return default
+
+
+class HTTPPool(object):
+    """Persistent connections to one HTTP endpoint."""
+
+    def __init__(self, host, port, protocol='http', unix_socket=None,
+                 key_file=None, cert_file=None, timeout=None, size=10,
+                 dns_cache_time=300):
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.unix_socket = unix_socket
+        self.key_file = key_file
+        self.cert_file = cert_file
+        self.timeout = timeout
+        self.size = size
+        self.dns_cache_time = dns_cache_time
+        self.idle = []
+        self._addresses = None
+        self._resolved = 0
+
+    def _resolve(self):
+        now = time.time()
+        if (self._addresses is None or
+                now - self._resolved >= self.dns_cache_time):
+            self._addresses = [info[4][:2] for info in socket.getaddrinfo(
+                self.host, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM)]
+            self._resolved = now
+        return self._addresses
+
+    def _create_connection(self, address, timeout=None, source_address=None):
+        """Connect to the cached addresses of the endpoint, in turn."""
+        error = None
+        for sockaddr in self._resolve():
+            try:
+                return socket.create_connection(sockaddr, timeout,
+                                                source_address)
+            except socket.error as e:
+                error = e
+        # NOTE: Resolve the endpoint again on the next connection.
+        self._addresses = None
+        raise error or socket.error('%s resolves to no address' % self.host)
+
+    def _connect(self):
+        if self.unix_socket:
+            return UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+        if self.protocol == 'http':
+            conn = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+        else:
+            conn = httplib.HTTPSConnection(self.host, self.port,
+                                           self.key_file, self.cert_file,
+                                           timeout=self.timeout)
+        conn._create_connection = self._create_connection
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request on a pooled connection.
+
+        :return (http response object, response body)
+        :raise socket.error or httplib.HTTPException on failure
+        """
+        while True:
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else self._connect()
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if reused:
+                    # NOTE: The server may have closed the idle connection
+                    # in the meantime, try another one.
+                    continue
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            if response.will_close or len(self.idle) >= self.size:
+                conn.close()
+            else:
+                self.idle.append(conn)
+            return response, data
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+def retry_after(response):
+    """Return the seconds an overloaded server asks to wait, if any."""
+    if response.status not in (httplib.SERVICE_UNAVAILABLE, 429):
+        return None
+    header = response.getheader('retry-after')
+    if not header:
+        return None
+    try:
+        return max(0, int(header))
+    except ValueError:
+        date = email.utils.parsedate_tz(header)
+        if date is None:
+            return None
+        return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+def fingerprint(user, tenant, roles):
+    """Return a digest of a set of credentials, to route their decisions."""
+    return hashlib.md5(jsonutils.dumps([user, tenant, sorted(roles or ())])
+                       ).hexdigest()
+
+
+def _hash(value):
+    return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+
+class HashRing(object):
+    """Consistent hash ring of the SIOS endpoints."""
+
+    def __init__(self, endpoints, replicas=100):
+        ring = sorted((_hash('%s-%d' % (endpoint.name, replica)), index)
+                      for index, endpoint in enumerate(endpoints)
+                      for replica in range(replicas))
+        self.endpoints = endpoints
+        self.hashes = [point for point, index in ring]
+        self.indexes = [index for point, index in ring]
+
+    def walk(self, key):
+        """Yield the endpoints in ring order, from the one owning a key."""
+        start = bisect.bisect(self.hashes, _hash(key))
+        seen = set()
+        for position in range(start, start + len(self.indexes)):
+            index = self.indexes[position % len(self.indexes)]
+            if index not in seen:
+                seen.add(index)
+                yield self.endpoints[index]
+                if len(seen) == len(self.endpoints):
+                    return
+
+
+class Endpoint(object):
+    """A SIOS endpoint and its health."""
+
+    def __init__(self, name, pool, stats):
+        self.name = name
+        self.pool = pool
+        self.stats = stats
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def request(self, method, path, body=None, headers=None):
+        self.outstanding += 1
+        start = time.time()
+        try:
+            return self.pool.request(method, path, body, headers)
+        except socket.timeout:
+            self.stats.inc('timeouts', self.name)
+            raise
+        except (socket.error, httplib.HTTPException):
+            self.stats.inc('errors', self.name)
+            raise
+        finally:
+            self.outstanding -= 1
+            self.stats.endpoints[self.name].observe(time.time() - start)
+
+    def succeeded(self):
+        self.failures = 0
+        self.ejected_until = 0
+
+    def failed(self, eject_failures, eject_time):
+        self.failures += 1
+        if self.failures >= eject_failures:
+            if self.available(time.time()):
+                self.stats.inc('ejections', self.name)
+                LOG.warn('Ejecting SIOS endpoint %s for %s seconds',
+                         self.name, eject_time)
+            self.ejected_until = time.time() + eject_time
+
+    def eject(self, seconds):
+        self.ejected_until = max(self.ejected_until, time.time() + seconds)
+
+
+class TokenManager(object):
+    """Keeps a token fresh from a background greenthread."""
+
+    def __init__(self, fetch, margin, retry_delay):
+        """
+        :param fetch: callable returning a new (token, expiry) tuple, the
+                      expiry being a naive UTC datetime
+        :param margin: seconds before its expiry a token is refreshed
+        :param retry_delay: seconds before the first retry of a failed
+                            refresh, the delay doubling with every retry
+        """
+        self.fetch = fetch
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self.token = None
+        self.expires = 0
+        self.lock = semaphore.Semaphore()
+        self.refresher = None
+
+    def get(self):
+        """Return the current token, fetching one if there is none yet.
+
+        Only the first call, or a call after the refreshes failed until the
+        token expired, waits for a token to be fetched. Concurrent callers
+        wait for the same fetch.
+
+        :raise ServiceError when no token could be fetched
+        """
+        if not self._valid():
+            with self.lock:
+                if not self._valid():
+                    self._update(self.fetch())
+        if self.refresher is None:
+            self.refresher = eventlet.spawn(self._run)
+        return self.token
+
+    def _valid(self):
+        return self.token is not None and self.expires > time.time()
+
+    def _update(self, fetched):
+        token, expiry = fetched
+        self.token = token
+        self.expires = calendar.timegm(expiry.utctimetuple())
+
+    def _refresh_delay(self):
+        # NOTE: Keep a second between two refreshes, even of tokens
+        # expiring sooner than the margin.
+        return max(self.expires - time.time() - self.margin, 1)
+
+    def _run(self):
+        delay = self._refresh_delay()
+        failures = 0
+        while True:
+            eventlet.sleep(delay)
+            try:
+                self._update(self.fetch())
+            except Exception as e:
+                LOG.warn('Failed to refresh the admin token: %s', e)
+                delay = min(self.retry_delay * 2 ** failures, 60)
+                failures += 1
+            else:
+                delay = self._refresh_delay()
+                failures = 0
+
+
+class Client(object):
+    """Client of SIOS, and of keystone on behalf of the shims."""
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.auth_admin_prefix = conf.auth_admin_prefix
+        self.pools = {}
+        self.stats = Stats()
+        self.endpoints = [self._endpoint(name)
+                          for name in self._endpoint_names()]
+        self.ring = None
+        if (conf.sios_routing == 'consistent_hash' and
+                len(self.endpoints) > 1):
+            self.ring = HashRing(self.endpoints)
+        self.cache = None
+        if conf.sios_cache_size > 0:
+            self.cache = DecisionCache(conf.sios_cache_size)
+        self.inflight = {}
+        self.refreshing = set()
+        self.token_managers = {}
+        # NOTE: Batches live as long as the scope, usually the request
+        # context of an API request, they were made for.
+        self.batches = weakref.WeakKeyDictionary()
+        self.policies = {}
+        self.snapshot_checks = {}
+        self.snapshot_updating = set()
+        if conf.sios_health_check_interval > 0:
+            eventlet.spawn_n(self._check_health)
+        if conf.sios_stats_interval > 0:
+            eventlet.spawn_n(self._log_stats)
+
+    def _endpoint_names(self):
+        conf = self.conf
+        if conf.sios_endpoints:
+            return conf.sios_endpoints
+        if conf.sios_unix_socket:
+            return [conf.sios_unix_socket]
+        return ['%s:%s' % (conf.sios_auth_host, conf.sios_auth_port)]
+
+    def _endpoint(self, name):
+        if name.startswith('/'):
+            return Endpoint(name, self._make_pool(None, None, name),
+                            self.stats)
+        host, port = name.rsplit(':', 1)
+        return Endpoint(name, self._make_pool(host.strip('[]'), int(port)),
+                        self.stats)
+
+    def _make_pool(self, host, port, unix_socket=None):
+        conf = self.conf
+        return HTTPPool(host, port, protocol=conf.auth_protocol,
+                        unix_socket=unix_socket,
+                        key_file=conf.keyfile, cert_file=conf.certfile,
+                        timeout=conf.sios_timeout,
+                        size=conf.sios_pool_size,
+                        dns_cache_time=conf.sios_dns_cache_time)
+
+    def pool(self, host, port):
+        """Return the connection pool of an endpoint."""
+        pool = self.pools.get((host, port))
+        if pool is None:
+            pool = self.pools[(host, port)] = self._make_pool(host, port)
+        return pool
+
+    def _select(self, tried, key=None):
+        """Return the available endpoint with the fewest requests pending.
+
+        With consistent hash routing, the endpoint owning the routing key is
+        preferred, or the next one on the ring if it is not available or
+        carries more than its share of the outstanding requests. Endpoints
+        already tried for the request are avoided, and ejected endpoints are
+        only used when no other one is left.
+        """
+        now = time.time()
+        if key is not None and self.ring is not None:
+            outstanding = sum(endpoint.outstanding
+                              for endpoint in self.endpoints)
+            bound = math.ceil(self.conf.sios_hash_load_factor *
+                              (outstanding + 1) / len(self.endpoints))
+            for endpoint in self.ring.walk(key):
+                if (endpoint not in tried and endpoint.available(now) and
+                        endpoint.outstanding < bound):
+                    return endpoint
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint not in tried and endpoint.available(now)]
+        if not candidates:
+            candidates = ([endpoint for endpoint in self.endpoints
+                           if endpoint not in tried] or self.endpoints)
+        fewest = min(endpoint.outstanding for endpoint in candidates)
+        return random.choice([endpoint for endpoint in candidates
+                              if endpoint.outstanding == fewest])
+
+    def sios_request(self, method, path, body=None, headers=None, key=None):
+        """Send a request to one of the SIOS endpoints.
+
+        :param key: Key routing the request with consistent hash routing.
+
+        A failed request is retried on another endpoint, after a backoff
+        once all of them have been tried. An answer asking to retry later is
+        retried on another endpoint if one is available.
+
+        When stale decisions are served, a request failing on every endpoint
+        is not retried after a backoff; those endpoints are ejected instead,
+        so that an outage does not stall the caller.
+
+        :return (http response object, response body)
+        :raise ServiceError when unable to communicate with SIOS
+        """
+        conf = self.conf
+        if conf.sios_stale_time > 0:
+            now = time.time()
+            if not any(endpoint.available(now)
+                       for endpoint in self.endpoints):
+                raise ServiceError('Every SIOS endpoint is ejected')
+        tried = []
+        failed = []
+        retry = 0
+        backoff = 0
+        while True:
+            endpoint = self._select(tried, key)
+            try:
+                response, data = endpoint.request(method, path, body,
+                                                  headers)
+            except (socket.error, httplib.HTTPException) as e:
+                endpoint.failed(conf.sios_eject_failures,
+                                conf.sios_eject_time)
+                tried.append(endpoint)
+                failed.append(endpoint)
+                exhausted = len(tried) >= len(self.endpoints)
+                if (retry == conf.sios_retries or
+                        exhausted and conf.sios_stale_time > 0):
+                    LOG.error('HTTP connection exception: %s', e)
+                    if conf.sios_stale_time > 0:
+                        # NOTE: Serving stale decisions, the next requests
+                        # fail at once rather than waiting for these
+                        # endpoints again.
+                        for endpoint in failed:
+                            endpoint.failed(1, conf.sios_eject_time)
+                    raise ServiceError('Unable to communicate with SIOS')
+                LOG.warn('Retrying on HTTP connection exception: %s', e)
+                self.stats.inc('retries')
+                if exhausted:
+                    eventlet.sleep(conf.sios_retry_delay * 2 ** backoff)
+                    backoff += 1
+                    tried = []
+                retry += 1
+                continue
+            delay = retry_after(response)
+            if delay is None:
+                endpoint.succeeded()
+                return response, data
+            self.stats.inc('retry_after', endpoint.name)
+            endpoint.eject(delay)
+            tried.append(endpoint)
+            now = time.time()
+            if retry == conf.sios_retries or not any(
+                    other.available(now) for other in self.endpoints
+                    if other not in tried):
+                return response, data
+            self.stats.inc('retries')
+            retry += 1
+
+    def _hedged_request(self, method, path, body=None, headers=None,
+                        key=None):
+        """Send a request to SIOS, and again if it is slow to answer.
+
+        :return the first answer, as (http response object, response body)
+        :raise ServiceError when no request succeeded
+        """
+        results = queue.LightQueue()
+
+        def attempt(key):
+            try:
+                results.put((True, self.sios_request(method, path, body,
+                                                     headers, key)))
+            except Exception as e:
+                results.put((False, e))
+
+        eventlet.spawn_n(attempt, key)
+        pending = 1
+        hedged = False
+        while True:
+            try:
+                succeeded, result = results.get(
+                    timeout=None if hedged else self.conf.sios_hedge_delay)
+            except queue.Empty:
+                # NOTE: The second request is likely to go to another
+                # endpoint, since the first one is still outstanding. It is
+                # not routed on the key, which would lead to the same one.
+                eventlet.spawn_n(attempt, None)
+                self.stats.inc('hedged')
+                pending += 1
+                hedged = True
+                continue
+            pending -= 1
+            if succeeded:
+                return result
+            if not pending:
+                raise result
+
+    def _log_stats(self):
+        while True:
+            eventlet.sleep(self.conf.sios_stats_interval)
+            LOG.info('SIOS client statistics: %s',
+                     jsonutils.dumps(self.stats.snapshot(), sort_keys=True))
+
+    def _check_health(self):
+        conf = self.conf
+        while True:
+            eventlet.sleep(conf.sios_health_check_interval)
+            for endpoint in self.endpoints:
+                try:
+                    response, data = endpoint.request('GET', '/')
+                except (socket.error, httplib.HTTPException) as e:
+                    LOG.debug('Health check of %s failed: %s',
+                              endpoint.name, e)
+                    endpoint.failed(conf.sios_eject_failures,
+                                    conf.sios_eject_time)
+                    continue
+                if response.status >= 500:
+                    endpoint.failed(conf.sios_eject_failures,
+                                    conf.sios_eject_time)
+                elif endpoint.failures:
+                    LOG.info('SIOS endpoint %s is healthy again',
+                             endpoint.name)
+                    endpoint.succeeded()
+
+    def http_request(self, host, port, method, path, body=None,
+                     headers=None):
+        """HTTP request helper used to make unspecified content type requests.
+
+        Failed requests are retried after 0.5, 1 and 2 seconds by default.
+
+        :return (http response object, response body)
+        :raise ServiceError when unable to communicate with the endpoint
+        """
+        pool = self.pool(host, port)
+        retry = 0
+        while True:
+            try:
+                return pool.request(method, path, body, headers)
+            except (socket.error, httplib.HTTPException) as e:
+                if retry == self.conf.sios_retries:
+                    LOG.error('HTTP connection exception: %s', e)
+                    raise ServiceError('Unable to communicate with %s:%s' %
+                                       (host, port))
+                LOG.warn('Retrying on HTTP connection exception: %s', e)
+                eventlet.sleep(self.conf.sios_retry_delay * 2 ** retry)
+                retry += 1
+
+    def json_request(self, method, path, body=None, headers=None,
+                     hedge=False, key=None):
+        """HTTP request helper used to make json requests to SIOS.
+
+        :param body: dict to encode to json as request body. Optional.
+        :param headers: dict of additional headers to send with the
+                        request. Optional.
+        :param hedge: Whether the request may be sent again to another
+                      endpoint if it is slow to answer.
+        :param key: Key routing the request with consistent hash routing.
+        :return (http response object, response body parsed as json)
+        :raise ServiceError when unable to communicate with SIOS
+        """
+        all_headers = dict(JSON_HEADERS)
+        if headers:
+            all_headers.update(headers)
+        if body:
+            body = jsonutils.dumps(body)
+        path = self.auth_admin_prefix + path
+        if (hedge and self.conf.sios_hedge_delay > 0 and
+                len(self.endpoints) > 1):
+            response, body = self._hedged_request(method, path, body,
+                                                  all_headers, key)
+        else:
+            response, body = self.sios_request(method, path, body,
+                                               all_headers, key)
+        try:
+            data = jsonutils.loads(body)
+        except ValueError:
+            LOG.debug('SIOS did not return json-encoded body')
+            data = {}
+        return response, data
+
+    def decide(self, service, mode, token, action, target, identity=None,
+               scope=None):
+        """Ask SIOS whether an action is allowed on a target.
+
+        :param service: The service whose policy applies, nova or glance.
+        :param mode: enforce or check.
+        :param token: The token of the caller.
+        :param identity: The (user, tenant, roles) of the caller, which
+                         route the request with consistent hash routing.
+                         The token routes it when they are not given.
+        :param scope: Object, usually a request context, whose prefetched
+                      decisions may answer the check. Its deferred checks
+                      are sent along if SIOS has to be asked.
+        :return the decision of SIOS
+        :raise ServiceError when unable to communicate with SIOS
+        """
+        start = time.time()
+        key = (service, mode, token, action, canonical_target(target))
+        batch = self.batches.get(scope) if scope is not None else None
+        try:
+            if batch is not None:
+                data = batch.decisions.get(key, MISSING)
+                if data is not MISSING:
+                    self.stats.inc('batch_hits')
+                    return data
+            if self.conf.sios_local_policy and identity:
+                data = self._decide_locally(service, token, action, target,
+                                            identity)
+                if data is not MISSING:
+                    return data
+            if self.cache is not None:
+                data, expires = self.cache.get(key,
+                                               self.conf.sios_stale_time)
+                if data is not MISSING:
+                    if expires > start:
+                        self.stats.inc('cache_hits')
+                    else:
+                        self.stats.inc('stale_hits')
+                        if key not in self.refreshing:
+                            self.refreshing.add(key)
+                            eventlet.spawn_n(self._refresh, key, token,
+                                             action, target, identity)
+                    return data
+                self.stats.inc('cache_misses')
+            if batch is not None and batch.deferred:
+                batch.deferred[key] = (action, target)
+                try:
+                    self._flush(batch, token, identity)
+                except ServiceError as e:
+                    LOG.warn('Failed to send deferred decisions: %s', e)
+                data = batch.decisions.get(key, MISSING)
+                if data is not MISSING:
+                    return data
+            return self._fetch(key, token, action, target, identity)
+        except ServiceError:
+            self.stats.inc('failed_decisions')
+            raise
+        finally:
+            self.stats.inc('decisions')
+            self.stats.actions[action].observe(time.time() - start)
+
+    def _decide_locally(self, service, token, action, target, identity):
+        local = self._local_policy(service, token)
+        if local is None:
+            return MISSING
+        user, tenant, roles = identity
+        creds = {'user': user, 'tenant': tenant, 'roles': list(roles)}
+        # NOTE: Evaluate the target SIOS would get if asked, so that the
+        # snapshot and SIOS decide on the same input.
+        target = jsonutils.loads(encode_target(target))
+        try:
+            data = local.decide(action, target, creds)
+        except Unsupported as e:
+            LOG.debug('Asking SIOS for %s: %s', action, e)
+            self.stats.inc('local_fallbacks')
+            return MISSING
+        self.stats.inc('local_decisions')
+        return data
+
+    def _local_policy(self, service, token):
+        """Return the policy snapshot of a service, if downloaded yet.
+
+        A check for a new snapshot is started in the background when one
+        is due, with the token of the caller.
+        """
+        now = time.time()
+        if (self.snapshot_checks.get(service, 0) +
+                self.conf.sios_snapshot_interval <= now and
+                service not in self.snapshot_updating):
+            self.snapshot_checks[service] = now
+            self.snapshot_updating.add(service)
+            eventlet.spawn_n(self._update_snapshot, service, token)
+        return self.policies.get(service)
+
+    def _snapshot_token(self, service, token):
+        """Return the token to download the policy of a service with.
+
+        It is the token of the source set for the service, usually the
+        admin token of its shim, or else the token of the caller.
+        """
+        source = _token_sources.get(service)
+        if source is None:
+            return token
+        try:
+            return source()
+        except ServiceError as e:
+            LOG.warn('Failed to get the admin token of %s, downloading its '
+                     'policy with the token of the caller: %s', service, e)
+            return token
+
+    def _update_snapshot(self, service, token):
+        headers = {'X-Auth-Token': self._snapshot_token(service, token)}
+        local = self.policies.get(service)
+        if local is not None:
+            headers['If-None-Match'] = '"%s"' % local.version
+        try:
+            response, data = self.json_request(
+                'GET', '/v1/pdp/%s/snapshot' % service, headers=headers)
+            if response.status == httplib.NOT_MODIFIED:
+                return
+            if response.status != httplib.OK:
+                LOG.warn('SIOS answered %s to a request for the policy '
+                         'snapshot of %s', response.status, service)
+                return
+            local = LocalPolicy(data)
+        except (ServiceError, KeyError, TypeError) as e:
+            LOG.warn('Failed to update the policy snapshot of %s: %s',
+                     service, e)
+            return
+        finally:
+            self.snapshot_updating.discard(service)
+        self.policies[service] = local
+        self.stats.inc('snapshot_updates')
+        LOG.info('Loaded version %s of the policy of %s', local.version,
+                 service)
+
+    def prefetch(self, scope, service, mode, token, checks, identity=None):
+        """Ask SIOS at once for the decisions of several checks.
+
+        The decisions answer later calls to decide() for the same scope.
+        Failures are only logged, the checks then being asked one by one.
+
+        :param scope: Object the decisions are kept for, usually the
+                      request context of an API request.
+        :param checks: (action, target) tuples.
+        """
+        batch = self.batches.setdefault(scope, Batch())
+        for action, target in checks:
+            key = (service, mode, token, action, canonical_target(target))
+            if key not in batch.decisions:
+                batch.deferred[key] = (action, target)
+        try:
+            self._flush(batch, token, identity)
+        except ServiceError as e:
+            LOG.warn('Failed to prefetch decisions: %s', e)
+
+    def defer(self, scope, service, mode, token, action, target):
+        """Register a check to be sent along with the next one of a scope.
+
+        :param scope: Object the decision is kept for, usually the request
+                      context of an API request.
+        """
+        batch = self.batches.setdefault(scope, Batch())
+        key = (service, mode, token, action, canonical_target(target))
+        if key not in batch.decisions:
+            batch.deferred[key] = (action, target)
+
+    def _flush(self, batch, token, identity):
+        """Send the deferred checks of a batch of a caller to SIOS."""
+        pending = []
+        for key, check in batch.deferred.items():
+            if key[2] != token:
+                continue
+            del batch.deferred[key]
+            if self.cache is not None:
+                data, expires = self.cache.get(key)
+                if data is not MISSING:
+                    batch.decisions[key] = data
+                    continue
+            pending.append((key, check))
+        size = max(self.conf.sios_batch_size, 1)
+        for i in range(0, len(pending), size):
+            self._decide_batch(batch, token, identity, pending[i:i + size])
+
+    def _decide_batch(self, batch, token, identity, pending):
+        items = [{'service': key[0], 'mode': key[1], 'action': action,
+                  'target': target or {}}
+                 for key, (action, target) in pending]
+        route = fingerprint(*identity) if identity else token
+        self.stats.inc('batch_requests')
+        response, data = self.json_request(
+            'POST', '/v1/pdp/batch', body={'items': items},
+            headers={'X-Auth-Token': token}, key=route)
+        if response.status >= httplib.INTERNAL_SERVER_ERROR:
+            raise ServiceError('SIOS answered %s' % response.status)
+        decisions = data.get('decisions') if isinstance(data, dict) else None
+        if (response.status != httplib.OK or
+                not isinstance(decisions, list) or
+                len(decisions) != len(pending)):
+            # NOTE: The checks are then asked one by one.
+            LOG.warn('SIOS answered %s to a batch of %d decisions',
+                     response.status, len(pending))
+            return
+        ttl = 0
+        if self.cache is not None:
+            ttl = cache_lifetime(response, self.conf.sios_cache_time)
+        for (key, check), decision in zip(pending, decisions):
+            batch.decisions[key] = decision
+            if ttl > 0:
+                self.cache.set(key, decision, ttl)
+        self.stats.counters['batched'] += len(pending)
+
+    def _refresh(self, key, token, action, target, identity):
+        try:
+            self._fetch(key, token, action, target, identity)
+        except Exception as e:
+            LOG.warn('Failed to refresh a stale decision: %s', e)
+        finally:
+            self.refreshing.discard(key)
+
+    def _fetch(self, key, token, action, target, identity):
+        if not self.conf.sios_coalesce:
+            return self._decide(key, token, action, target, identity)
+
+        waiter = self.inflight.get(key)
+        if waiter is not None:
+            self.stats.inc('coalesced')
+            return waiter.wait()
+        waiter = self.inflight[key] = event.Event()
+        try:
+            data = self._decide(key, token, action, target, identity)
+        except Exception as e:
+            waiter.send_exception(e)
+            raise
+        except BaseException:
+            # NOTE: The greenthread is being killed, do not leave the
+            # others waiting.
+            waiter.send_exception(ServiceError('Request interrupted'))
+            raise
+        else:
+            waiter.send(data)
+        finally:
+            del self.inflight[key]
+        return data
+
+    def _decide(self, key, token, action, target, identity=None):
+        service, mode = key[:2]
+        # NOTE: The target is sent as JSON, as in the body of a batch, so
+        # that SIOS evaluates the same target whichever way it is asked.
+        headers = {'X-Auth-Token': token, 'X-Action': action,
+                   'X-Target': encode_target(target)}
+        route = fingerprint(*identity) if identity else token
+        response, data = self.json_request(
+            'POST', '/v1/pdp/%s/%s' % (service, mode), headers=headers,
+            hedge=True, key=route)
+        if response.status >= httplib.INTERNAL_SERVER_ERROR:
+            raise ServiceError('SIOS answered %s' % response.status)
+        if self.cache is not None and response.status == httplib.OK:
+            ttl = cache_lifetime(response, self.conf.sios_cache_time)
+            if ttl > 0:
+                self.cache.set(key, data, ttl)
+        return data
+
+    def admin_token(self, key, fetch):
+        """Return the admin token of a set of credentials.
+
+        The token is shared by every caller passing the same key. The first
+        call fetches it, then a background greenthread keeps it fresh.
+
+        :param key: Identifies the credentials, e.g. (keystone host, port,
+                    user, tenant).
+        :param fetch: callable returning a new (token, expiry) tuple, the
+                      expiry being a naive UTC datetime
+        :return the token
+        :raise ServiceError when no token could be fetched
+        """
+        manager = self.token_managers.get(key)
+        if manager is None:
+            manager = self.token_managers[key] = TokenManager(
+                fetch, self.conf.sios_token_refresh_margin,
+                self.conf.sios_retry_delay)
+        return manager.get()
+
+    def flush_cache(self):
+        """Forget every cached decision and policy snapshot."""
+        if self.cache is not None:
+            self.cache.clear()
+        self.policies.clear()
+        self.snapshot_checks.clear()
+
+
+_client = None
+_client_pid = None
+_token_sources = {}
+
+
+def set_token_source(service, source):
+    """Download the policy snapshots of a service with a token of its own.
+
+    :param service: The service whose policy is downloaded, nova or glance.
+    :param source: callable returning the token, usually the admin token
+                   of the shim of the service.
+    """
+    _token_sources[service] = source
+
+
+def get_client():
+    """Return the client of this process."""
+    global _client, _client_pid
+    # NOTE: Connections must not be shared with forked API workers.
+    if _client is None or _client_pid != os.getpid():
+        _client = Client(CONF.authtoken)
+        _client_pid = os.getpid()
+    return _client
+
+
+def flush_cache():
+    """Forget the decisions cached by the client of this process."""
+    if _client is not None:
+        _client.flush_cache()
+
+
+def get_stats():
+    """Return the statistics of the client of this process.
+
+    :return dict with the counters of the client, and the latency of the
+            decisions per action and of the requests per SIOS endpoint,
+            in seconds
+    """
+    return get_client().stats.snapshot()
@@ -13,12 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from oslo.serialization import jsonutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 import webob.exc
 
 from sios.api import policy
+from sios.api import session
+from sios.common import exception
 from sios.common import wsgi
 import sios.context
 from sios import i18n
@@ -46,6 +48,21 @@ CONF.register_opts(context_opts)
 LOG = logging.getLogger(__name__)
 
 
+def get_target(req):
+    """Return the target of a PDP request, sent as JSON in X-Target.
+
+    A target which is not JSON, as sent by older policy shims, is passed on
+    as it is.
+    """
+    target = req.headers.get('X-Target')
+    if target is None:
+        return None
+    try:
+        return jsonutils.loads(target)
+    except ValueError:
+        return target
+
+
 class BaseContextMiddleware(wsgi.Middleware):
     def process_response(self, resp):
         try:
@@ -59,7 +76,7 @@ class BaseContextMiddleware(wsgi.Middleware):
 
 class ContextMiddleware(BaseContextMiddleware):
     def __init__(self, app):
-        self.policy_enforcer = policy.Enforcer()
+        self.policy_enforcer = policy.get_enforcer()
         super(ContextMiddleware, self).__init__(app)
 
     def process_request(self, req):
@@ -71,11 +88,14 @@ class ContextMiddleware(BaseContextMiddleware):
 
         :param req: wsgi request object that will be given the context object
         :raises webob.exc.HTTPUnauthorized: when value of the X-Identity-Status
-                                            header is not 'Confirmed' and
+                                            header is not 'Confirmed', no
+                                            valid PDP session is given and
                                             anonymous access is disallowed
         """
         if req.headers.get('X-Identity-Status') == 'Confirmed':
             req.context = self._get_authenticated_context(req)
+        elif session.HEADER in req.headers:
+            req.context = self._get_session_context(req)
         elif CONF.allow_anonymous_access:
             req.context = self._get_anonymous_context()
         else:
@@ -111,7 +131,7 @@ class ContextMiddleware(BaseContextMiddleware):
                     _('Invalid service catalog json.'))
 
 	action = req.headers.get('X-Action')
-	target = req.headers.get('X-Target')
+	target = get_target(req)
 
         kwargs = {
             'user': req.headers.get('X-User-Id'),
@@ -129,6 +149,25 @@ class ContextMiddleware(BaseContextMiddleware):
         return sios.context.RequestContext(**kwargs)
 
 
+    def _get_session_context(self, req):
+        try:
+            credentials = session.verify(req.headers[session.HEADER])
+        except exception.InvalidSession as e:
+            raise webob.exc.HTTPUnauthorized(explanation=e.msg)
+        roles = list(credentials['roles'])
+        kwargs = {
+            'user': credentials['user'],
+            'tenant': credentials['tenant'],
+            'roles': roles,
+            'is_admin': CONF.admin_role.strip().lower() in roles,
+            'owner_is_tenant': CONF.owner_is_tenant,
+            'policy_enforcer': self.policy_enforcer,
+            'action': req.headers.get('X-Action'),
+            'target': get_target(req),
+        }
+        return sios.context.RequestContext(**kwargs)
+
+
 class UnauthenticatedContextMiddleware(BaseContextMiddleware):
     def process_request(self, req):
         """Create a context without an authorized user."""
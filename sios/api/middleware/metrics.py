@@ -0,0 +1,82 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A filter middleware recording request metrics and serving them.
+
+It belongs at the head of the pipeline, ahead of authtoken, so that scraping
+the metrics neither needs a token nor costs a token validation.
+"""
+
+import time
+
+from oslo_config import cfg
+
+from sios.common import metrics
+from sios.common import wsgi
+
+CONF = cfg.CONF
+CONF.import_opt('service_policy_files', 'sios.api.policy')
+
+
+class MetricsMiddleware(wsgi.Middleware):
+
+    def __init__(self, app):
+        self.enabled = CONF.metrics.enabled
+        self.path = CONF.metrics.path
+        super(MetricsMiddleware, self).__init__(app)
+
+    def _endpoint(self, environ):
+        """Name the endpoint a request was routed to, if any.
+
+        Requests to a service's decision resources are named the way the
+        decision cache names them, <mode>_<service>.
+        """
+        try:
+            args = environ['wsgiorg.routing_args'][1]
+        except (KeyError, IndexError, TypeError):
+            return 'unrouted'
+        action = args.get('action', 'unrouted')
+        if (action == 'decide' and
+                args.get('service') in CONF.service_policy_files):
+            return '%s_%s' % (args['mode'], args['service'])
+        return action
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.application(environ, start_response)
+        metrics.start_snapshots()
+        if environ.get('PATH_INFO') == self.path:
+            body = metrics.render().encode('utf-8')
+            start_response('200 OK', [('Content-Type', metrics.CONTENT_TYPE),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+
+        status = []
+
+        def _start_response(response_status, headers, exc_info=None):
+            status.append(response_status.split(' ', 1)[0])
+            return start_response(response_status, headers, exc_info)
+
+        start = time.time()
+        try:
+            return self.application(environ, _start_response)
+        finally:
+            endpoint = self._endpoint(environ)
+            metrics.HTTP_REQUEST_SECONDS.observe((endpoint,),
+                                                 time.time() - start)
+            metrics.HTTP_REQUESTS.inc((endpoint,
+                                       environ.get('REQUEST_METHOD'),
+                                       status[0] if status else '500'))
@@ -0,0 +1,99 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+A filter middleware answering plain PDP decision requests itself.
+
+It recognizes the decision resources of the v1 API through a static table
+and answers them with pre-encoded bodies, skipping the URL map, the router
+and the (de)serializers. Anything else, including decisions asking for an
+explanation, falls through to the rest of the pipeline. It must come after
+the context middleware, whose request context it uses.
+"""
+
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+
+from sios.api.v1 import pdp
+from sios.common import wsgi
+from sios import i18n
+
+_ = i18n._
+
+fast_path_opts = [
+    cfg.BoolOpt('pdp_fast_path', default=False,
+                help=_('Answer plain PDP decision requests before they '
+                       'reach the API router, with pre-encoded bodies. '
+                       'Requires the pdpfastpath filter in the paste '
+                       'pipeline.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(fast_path_opts)
+
+_HEADERS = [('Content-Type', 'application/json')]
+
+_TRUE = ('true', _HEADERS + [('Content-Length', '4')])
+_FALSE = ('false', _HEADERS + [('Content-Length', '5')])
+
+
+class PDPFastPath(wsgi.Middleware):
+
+    def __init__(self, app):
+        self.enabled = CONF.pdp_fast_path
+        self.controller = pdp.get_controller()
+        self.routes = {}
+        for service in CONF.service_policy_files:
+            for mode in pdp.MODES:
+                self._add_route('/v1/pdp/%s/%s' % (service, mode),
+                                service, mode)
+        for service, mode in (('glance', 'check'), ('glance', 'enforce'),
+                              ('nova', 'enforce')):
+            if service in CONF.service_policy_files:
+                self._add_route('/v1/pdp/%s_%s' % (mode, service),
+                                service, mode)
+        super(PDPFastPath, self).__init__(app)
+
+    def _add_route(self, path, service, mode):
+        routing_args = ((), {'action': 'decide', 'service': service,
+                             'mode': mode})
+        self.routes[path] = (service, mode, routing_args)
+
+    def __call__(self, environ, start_response):
+        route = self.routes.get(environ.get('PATH_INFO'))
+        if (route is None or not self.enabled or
+                environ.get('REQUEST_METHOD') != 'POST' or
+                environ.get('QUERY_STRING') or
+                'HTTP_X_PDP_EXPLAIN' in environ):
+            return self.application(environ, start_response)
+        try:
+            context = environ['webob.adhoc_attrs']['context']
+        except KeyError:
+            return self.application(environ, start_response)
+
+        service, mode, routing_args = route
+        environ['wsgiorg.routing_args'] = routing_args
+        pdp_decision = self.controller.decision(context, service, mode,
+                                                context.action,
+                                                context.target)
+        if pdp_decision is True:
+            body, headers = _TRUE
+        elif pdp_decision is False:
+            body, headers = _FALSE
+        else:
+            body = jsonutils.dumps(pdp_decision)
+            headers = _HEADERS + [('Content-Length', str(len(body)))]
+        start_response('200 OK', list(headers))
+        return [body]
@@ -16,17 +16,62 @@
 
 """Policy Engine For SIOS"""
 
+import collections
 import copy
+import os
 
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_policy import policy
+from oslo_serialization import jsonutils
 
+from sios.api import policy_compiler
+from sios.api import policy_explain
+from sios.api import policy_snapshot
 from sios.common import exception
+from sios.common import file_watcher
+from sios.common import metrics
 from sios import i18n
 
+_ = i18n._
+_LE = i18n._LE
+_LI = i18n._LI
+_LW = i18n._LW
+
+policy_opts = [
+    cfg.StrOpt('policy_engine', default='interpreted',
+               choices=['interpreted', 'compiled'],
+               help=_('How policy rules are evaluated. "interpreted" walks '
+                      'the oslo.policy check tree on every decision, '
+                      '"compiled" turns the loaded rules into pre-linked '
+                      'Python callables once per policy load.')),
+    cfg.BoolOpt('policy_file_watcher', default=True,
+                help=_('Reload the policy files from a background '
+                       'greenthread of every worker when they change, '
+                       'instead of checking their modification time on '
+                       'every decision. inotify is used where it is '
+                       'available.')),
+    cfg.IntOpt('policy_poll_interval', default=5,
+               help=_('Number of seconds between two checks of the policy '
+                      'files by the policy file watcher, when inotify is '
+                      'not available.')),
+    cfg.IntOpt('policy_role_sets', default=1024,
+               help=_('Maximum number of distinct role sets for which the '
+                      'compiled policy engine keeps the precomputed '
+                      'outcome of every rule depending only on roles. Set '
+                      'to 0 to evaluate those rules on every decision.')),
+    cfg.DictOpt('service_policy_files',
+                default={'glance': 'policy_glance.json',
+                         'nova': 'policy_nova.json'},
+                help=_('Policy file of each service SIOS decides for, as '
+                       'service:file pairs. Every service gets its own '
+                       'rules, loaded and reloaded independently. A service '
+                       'whose file cannot be found falls back to the '
+                       'policy.json shared by all services.')),
+]
 
 CONF = cfg.CONF
+CONF.register_opts(policy_opts)
 LOG = logging.getLogger(__name__)
 
 CONF.oslo_policy.policy_file = "policy.json"
@@ -37,25 +82,315 @@ DEFAULT_RULES = policy.Rules.from_dict({
     'manage_image_cache': 'role:admin',
 })
 
-_ = i18n._
-_LI = i18n._LI
-_LW = i18n._LW
+
+_ENFORCERS = {}
+
+
+def get_services():
+    """Return the names of the services SIOS decides for."""
+    return sorted(CONF.service_policy_files)
+
+
+def get_enforcer(service=None):
+    """Return the Enforcer shared by every decision made for a service.
+
+       :param service: Name of the service, or None for the rules of the
+                       shared policy.json.
+       :raises: `sios.common.exception.NotFound` for an unknown service
+    """
+    enforcer = _ENFORCERS.get(service)
+    if enforcer is None:
+        if service is not None and service not in CONF.service_policy_files:
+            raise exception.NotFound()
+        enforcer = _ENFORCERS[service] = Enforcer(service)
+    return enforcer
 
 
 class Enforcer(policy.Enforcer):
     """Responsible for loading and enforcing rules"""
 
-    def __init__(self):
-        if CONF.find_file(CONF.oslo_policy.policy_file):
+    def __init__(self, service=None):
+        policy_file = CONF.oslo_policy.policy_file
+        if service is not None:
+            service_file = CONF.service_policy_files.get(service)
+            if service_file and CONF.find_file(service_file):
+                policy_file = service_file
+        if CONF.find_file(policy_file):
             kwargs = dict(rules=None, use_conf=True)
         else:
             kwargs = dict(rules=DEFAULT_RULES, use_conf=False)
-        super(Enforcer, self).__init__(CONF, overwrite=False, **kwargs)
+        self.service = service
+        self.engine = CONF.policy_engine
+        self.version = 0
+        self._compiled = None
+        self._raw_rules = None
+        self._snapshot = None
+        self._changes = collections.deque(maxlen=32)
+        self._watcher = None
+        self._watcher_pid = None
+        super(Enforcer, self).__init__(CONF, policy_file=policy_file,
+                                       **kwargs)
 
     def add_rules(self, rules):
         """Add new rules to the Rules object"""
         self.set_rules(rules, overwrite=False, use_conf=self.use_conf)
 
+    def set_rules(self, rules, overwrite=True, use_conf=False):
+        """Replace or update the rules, dropping any compiled copy"""
+        super(Enforcer, self).set_rules(rules, overwrite=overwrite,
+                                        use_conf=use_conf)
+        self._compiled = None
+        self._raw_rules = None
+        self.version += 1
+        self._changes.append((self.version, None))
+
+    def load_rules(self, force_reload=False):
+        """Load the rules, unless a watcher reloads them on change.
+
+           With the policy file watcher enabled, the rules are loaded once
+           per worker, which then starts watching the policy files. The
+           decision path never touches the file system afterwards.
+        """
+        if not CONF.policy_file_watcher or force_reload or not self.use_conf:
+            return super(Enforcer, self).load_rules(force_reload)
+        # NOTE: Watchers are per process; the enforcers are created before
+        # the API workers are forked.
+        if self._watcher_pid != os.getpid():
+            self._start_watcher()
+
+    def _start_watcher(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+        if not self.policy_path:
+            self.policy_path = self._get_policy_path(self.policy_file)
+        paths = [self.policy_path] + self._get_policy_dirs()
+        self._watcher = file_watcher.FileWatcher(
+            paths, self._reload, interval=CONF.policy_poll_interval)
+        # NOTE: Watch before loading, so no change can be missed.
+        self._watcher.start()
+        self._load_policy()
+        self._watcher_pid = os.getpid()
+
+    def _get_policy_dirs(self):
+        paths = []
+        for path in CONF.oslo_policy.policy_dirs:
+            try:
+                paths.append(self._get_policy_path(path))
+            except cfg.ConfigFilesNotFoundError:
+                continue
+        return paths
+
+    def _read_policy(self):
+        """Return the rule strings of the policy file and directories.
+
+           Files of the policy directories override the policy file, in
+           the order oslo.policy loads them.
+        """
+        paths = [self.policy_path]
+        for path in self._get_policy_dirs():
+            names = sorted(next(os.walk(path))[2])
+            paths.extend(os.path.join(path, name) for name in names
+                         if not name.startswith('.'))
+        raw = {}
+        for path in paths:
+            with open(path) as policy_file:
+                raw.update(jsonutils.loads(policy_file.read()))
+        return raw
+
+    def _load_policy(self):
+        """Load the policy files, parsing and compiling only what changed.
+
+           The new rules, and their compiled copy when there is one, are
+           built aside and published at once, so decisions in flight keep
+           using the rules they started with.
+        """
+        raw = self._read_policy()
+        old_raw = self._raw_rules
+        if old_raw is None:
+            changed = None
+            rules = policy.Rules.load_json(jsonutils.dumps(raw),
+                                           self.default_rule)
+        else:
+            changed = set(name for name in set(raw) | set(old_raw)
+                          if raw.get(name) != old_raw.get(name))
+            if not changed:
+                return
+            rules = policy.Rules.load_json(
+                jsonutils.dumps(dict((name, raw[name]) for name in changed
+                                     if name in raw)),
+                self.default_rule)
+            for name in raw:
+                if name not in changed:
+                    rules[name] = self.rules[name]
+
+        compiled = affected = None
+        if self._compiled is not None or self.engine == 'compiled':
+            previous = self._compiled if changed is not None else None
+            compiled = policy_compiler.CompiledRules(
+                rules, role_sets=CONF.policy_role_sets,
+                previous=previous, changed=changed)
+            affected = compiled.affected
+        elif changed is not None:
+            # NOTE: Decisions on rules referring to a changed rule, even
+            # a removed one, change too.
+            affected = policy_compiler.dependents(
+                policy_compiler.references(rules), changed)
+        if affected is not None and self.default_rule in affected:
+            # NOTE: Decisions on unknown actions depend on the default rule.
+            affected = None
+
+        self.rules = rules
+        self._compiled = compiled
+        self._raw_rules = raw
+        self.version += 1
+        self._changes.append((self.version, affected))
+        LOG.debug('Loaded %(count)d policy rules, %(changed)s of them '
+                  'changed', {'count': len(rules),
+                              'changed': len(affected) if affected is not None
+                              else 'all'})
+
+    def _reload(self):
+        LOG.info(_LI('Reloading policy files of %s'),
+                 self.service or 'all services')
+        labels = (self.service or 'default',)
+        try:
+            with metrics.Timer(metrics.POLICY_RELOAD_SECONDS, labels):
+                self._load_policy()
+        except Exception:
+            metrics.POLICY_RELOADS.inc(labels + ('failure',))
+            LOG.exception(_LE('Failed to reload the policy files, keeping '
+                              'the rules loaded before'))
+        else:
+            metrics.POLICY_RELOADS.inc(labels + ('success',))
+
+    def changed_since(self, version):
+        """Return the names of the rules changed after a version.
+
+           :param version: A version returned by get_version().
+           :returns: A set of rule names, or None when every rule may have
+                     changed or the changes are no longer known.
+        """
+        if version is None:
+            return None
+        if version == self.version:
+            return set()
+        changed = set()
+        for change_version, names in reversed(self._changes):
+            if change_version <= version or names is None:
+                break
+            changed.update(names)
+            if change_version == version + 1:
+                return changed
+        return None
+
+    def get_version(self):
+        """Load the rules if needed and return their version.
+
+           The version changes every time the rules are replaced or updated,
+           so anything derived from the rules can be keyed on it.
+        """
+        self.load_rules()
+        return self.version
+
+    def _get_compiled(self):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = policy_compiler.CompiledRules(
+                self.rules, role_sets=CONF.policy_role_sets)
+            LOG.debug('Compiled %d policy rules, %d of them precomputed '
+                      'per role set', len(compiled), len(compiled.columns))
+            self._compiled = compiled
+        return compiled
+
+    def analyze(self):
+        """Classify the rules by what their outcome depends on.
+
+           :returns: dict with the rules of each kind, their counts and the
+                     size of the per role set decision matrix.
+        """
+        self.load_rules()
+        return self._get_compiled().analysis()
+
+    def snapshot(self):
+        """Export the rules for evaluation by the policy shims.
+
+           The export is redone only when the rules have changed.
+
+           :returns: dict with the lowered rules and their version, see
+                     `sios.api.policy_snapshot.export`.
+        """
+        self.load_rules()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != self.version:
+            snapshot = (self.version,
+                        policy_snapshot.export(self.rules, self.service))
+            self._snapshot = snapshot
+        return snapshot[1]
+
+    def _credentials(self, context):
+        return {
+            'roles': context.roles,
+            'user': context.user,
+            'tenant': context.tenant,
+        }
+
+    def _decide(self, context, action, target):
+        credentials = self._credentials(context)
+        if self.engine == 'compiled':
+            self.load_rules()
+            # NOTE: The memo lives as long as the request context, so named
+            # rules shared by several decisions of a request are evaluated
+            # once for its credentials.
+            memo = getattr(context, 'policy_memo', None)
+            return self._get_compiled().enforce(action, target, credentials,
+                                                self, memo=memo)
+        return super(Enforcer, self).enforce(action, target, credentials)
+
+    def explain(self, context, action, target):
+        """Trace the evaluation of an action in this context.
+
+           :param context: Sios request context
+           :param action: String representing the action to be checked
+           :param target: Dictionary representing the object of the action.
+           :returns: The evaluated check tree, see
+                     `sios.api.policy_explain.explain`.
+        """
+        self.load_rules()
+        result, trace = policy_explain.explain(
+            self.rules, action, target, self._credentials(context), self)
+        return trace
+
+    def permissions(self, context):
+        """Sort every action by whether it is allowed in this context.
+
+           Actions whose rule looks at the target, or is delegated to a
+           custom check, can only be decided for a given target and are
+           reported as conditional.
+
+           :param context: Sios request context
+           :returns: dict with sorted lists of the 'allowed', 'denied' and
+                     'conditional' actions.
+        """
+        self.load_rules()
+        compiled = self._get_compiled()
+        credentials = self._credentials(context)
+        memo = getattr(context, 'policy_memo', None)
+        target = {}
+        result = {'allowed': [], 'denied': [], 'conditional': []}
+        for action, kind in sorted(compiled.kinds.items()):
+            if kind in (policy_compiler.CONDITIONAL,
+                        policy_compiler.DELEGATED):
+                result['conditional'].append(action)
+                continue
+            if self.engine == 'compiled':
+                allowed = compiled.enforce(action, target, credentials,
+                                           self, memo=memo)
+            else:
+                allowed = super(Enforcer, self).enforce(action, target,
+                                                        credentials)
+            result['allowed' if allowed else 'denied'].append(action)
+        return result
+
     def enforce(self, context, action, target):
         """Verifies that the action is valid on the target in this context.
 
@@ -65,15 +400,10 @@ class Enforcer(policy.Enforcer):
            :raises: `glance.common.exception.Forbidden`
            :returns: A non-False value if access is allowed.
         """
-        credentials = {
-            'roles': context.roles,
-            'user': context.user,
-            'tenant': context.tenant,
-        }
-        return super(Enforcer, self).enforce(action, target, credentials,
-                                             do_raise=True,
-                                             exc=exception.Forbidden,
-                                             action=action)
+        result = self._decide(context, action, target)
+        if not result:
+            raise exception.Forbidden(action=action)
+        return result
 
     def check(self, context, action, target):
         """Verifies that the action is valid on the target in this context.
@@ -83,12 +413,7 @@ class Enforcer(policy.Enforcer):
            :param target: Dictionary representing the object of the action.
            :returns: A non-False value if access is allowed.
         """
-        credentials = {
-            'roles': context.roles,
-            'user': context.user,
-            'tenant': context.tenant,
-        }
-        return super(Enforcer, self).enforce(action, target, credentials)
+        return self._decide(context, action, target)
 
     def check_is_admin(self, context):
         """Check if the given context is associated with an admin role,
@@ -0,0 +1,682 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compiler turning oslo.policy check trees into flat Python callables.
+
+The interpreter shipped with oslo.policy walks the check tree of a rule on
+every decision, resolving ``rule:`` references through the Rules mapping and
+re-parsing the kind and match of every generic check. The compiler does that
+work once per rule set: rule references are linked directly to the compiled
+callable of the referenced rule, nested and/or checks are flattened, constant
+branches are folded away and target accessors are prepared up front.
+
+Compiled rules answer exactly as the interpreter would, including the cases
+where the interpreter fails closed on a missing key.
+
+Decisions may share a memo table, typically one per request: every named rule
+which is not trivially cheap is then evaluated at most once per target for
+the credentials of that request, and only once overall when it does not look
+at the target.
+"""
+
+import ast
+import re
+
+from oslo_policy import _checks
+from oslo_serialization import jsonutils
+import six
+
+from sios.common import cache
+
+
+_SINGLE_KEY_RE = re.compile(r'^%\(([^)]+)\)s$')
+
+# NOTE: What the outcome of a compiled check depends on. 'roles' is the set
+# of roles of the caller, regardless of their order and case, 'target_type'
+# whether the target is a dict and 'external' covers checks delegated to
+# oslo.policy, which may look at anything.
+TARGET = 'target'
+TARGET_TYPE = 'target_type'
+ROLES = 'roles'
+CREDS = 'creds'
+EXTERNAL = 'external'
+
+# NOTE: How a rule is classified by what its outcome depends on, from the
+# cheapest to precompute to the most expensive.
+CONSTANT = 'constant'
+ROLE = 'role'
+CREDENTIALS = 'credentials'
+CONDITIONAL = 'conditional'
+DELEGATED = 'external'
+KINDS = (CONSTANT, ROLE, CREDENTIALS, CONDITIONAL, DELEGATED)
+
+_NO_DEPS = frozenset()
+
+_MISSING = object()
+
+
+def _target_key(target):
+    """Return a hashable stand-in for a target, for memo keys."""
+    try:
+        if isinstance(target, dict):
+            return jsonutils.dumps(target, sort_keys=True)
+        hash(target)
+        return target
+    except (TypeError, ValueError):
+        # NOTE: Never share memo entries for a target we cannot key.
+        return object()
+
+
+class _Env(object):
+    """Per-decision state shared by all compiled checks."""
+
+    __slots__ = ('enforcer', 'roles', 'memo', 'target_key', 'target_is_dict')
+
+    def __init__(self, target, creds, enforcer, memo):
+        self.enforcer = enforcer
+        self.memo = memo
+        self.target_key = _MISSING
+        self.target_is_dict = isinstance(target, dict)
+        try:
+            self.roles = frozenset([x.lower() for x in creds['roles']])
+        except Exception:
+            # NOTE: Let the role checks reproduce whatever the interpreter
+            # would have raised for these credentials.
+            self.roles = None
+
+
+class _Node(object):
+    """A compiled check.
+
+    :param func: callable taking (target, creds, env)
+    :param const: True or False when the check is constant, None otherwise
+    :param is_bool: whether func is known to return a bool
+    :param deps: frozenset of what the outcome depends on
+    :param leaf: whether the check is too cheap to be worth memoizing
+    """
+
+    __slots__ = ('func', 'const', 'is_bool', 'deps', 'leaf')
+
+    def __init__(self, func, const=None, is_bool=True, deps=_NO_DEPS,
+                 leaf=False):
+        self.func = func
+        self.const = const
+        self.is_bool = is_bool
+        self.deps = deps
+        self.leaf = leaf or const is not None
+
+
+def _always_true(target, creds, env):
+    return True
+
+
+def _always_false(target, creds, env):
+    return False
+
+
+_TRUE = _Node(_always_true, const=True)
+_FALSE = _Node(_always_false, const=False)
+
+
+def _fallback(check):
+    """Delegate a check the compiler does not know how to lower."""
+    def func(target, creds, env):
+        return check(target, creds, env.enforcer)
+    return _Node(func, is_bool=False, deps=frozenset([EXTERNAL]))
+
+
+def _compile_role(check):
+    match = check.match.lower()
+
+    def func(target, creds, env):
+        roles = env.roles
+        if roles is None:
+            return check(target, creds, env.enforcer)
+        return match in roles
+    return _Node(func, deps=frozenset([ROLES]), leaf=True)
+
+
+def _compile_generic(check):
+    match = check.match
+    try:
+        literal = ast.literal_eval(check.kind)
+        path = None
+    except ValueError:
+        literal = None
+        path = tuple(check.kind.split('.'))
+    except Exception:
+        # NOTE: The interpreter only evaluates the kind once the match has
+        # been formatted, so keep its exact error behaviour.
+        return _fallback(check)
+    if path is None:
+        try:
+            literal = six.text_type(literal)
+        except Exception:
+            return _fallback(check)
+
+    # NOTE: Non-dict targets are formatted into the match, which may raise.
+    deps = set([TARGET_TYPE])
+    if path is not None:
+        deps.add(CREDS)
+    key = _SINGLE_KEY_RE.match(match)
+    if key is not None:
+        deps.add(TARGET)
+        key = key.group(1)
+        fmt = match[:0] + '%s'
+    elif '%' in match:
+        return _fallback(check)
+
+    def right(target):
+        if not isinstance(target, dict):
+            return match % target
+        if key is None:
+            return match
+        return fmt % (target[key],)
+
+    if path is None:
+        def func(target, creds, env):
+            try:
+                value = right(target)
+            except KeyError:
+                return False
+            return value == literal
+    elif len(path) == 1:
+        first = path[0]
+
+        def func(target, creds, env):
+            try:
+                value = right(target)
+            except KeyError:
+                return False
+            try:
+                leftval = creds[first]
+            except KeyError:
+                return False
+            return value == six.text_type(leftval)
+    else:
+        def func(target, creds, env):
+            try:
+                value = right(target)
+            except KeyError:
+                return False
+            leftval = creds
+            try:
+                for part in path:
+                    leftval = leftval[part]
+            except KeyError:
+                return False
+            return value == six.text_type(leftval)
+    return _Node(func, deps=frozenset(deps), leaf=True)
+
+
+def _compile_not(node):
+    if node.const is not None:
+        return _FALSE if node.const else _TRUE
+    inner = node.func
+
+    def func(target, creds, env):
+        return not inner(target, creds, env)
+    return _Node(func, deps=node.deps, leaf=node.leaf)
+
+
+def _fold(nodes, absorbing):
+    """Drop neutral members and everything after an absorbing constant.
+
+    Members before an absorbing constant are kept since the interpreter
+    would still evaluate them, and they might raise.
+    """
+    kept = []
+    for node in nodes:
+        if node.const is None:
+            kept.append(node)
+        elif node.const is absorbing:
+            kept.append(node)
+            break
+    return kept
+
+
+def _deps(nodes):
+    return frozenset().union(*[node.deps for node in nodes])
+
+
+def _compile_and(nodes):
+    nodes = _fold(nodes, False)
+    if not nodes:
+        return _TRUE
+    if len(nodes) == 1:
+        return nodes[0] if nodes[0].is_bool else _compile_bool(nodes[0])
+    if nodes[0].const is False:
+        return _FALSE
+    funcs = tuple(node.func for node in nodes)
+    if len(funcs) == 2:
+        first, second = funcs
+
+        def func(target, creds, env):
+            if not first(target, creds, env):
+                return False
+            return True if second(target, creds, env) else False
+    else:
+        def func(target, creds, env):
+            for check in funcs:
+                if not check(target, creds, env):
+                    return False
+            return True
+    return _Node(func, deps=_deps(nodes))
+
+
+def _compile_or(nodes):
+    nodes = _fold(nodes, True)
+    if not nodes:
+        return _FALSE
+    if len(nodes) == 1:
+        return nodes[0] if nodes[0].is_bool else _compile_bool(nodes[0])
+    if nodes[0].const is True:
+        return _TRUE
+    funcs = tuple(node.func for node in nodes)
+    if len(funcs) == 2:
+        first, second = funcs
+
+        def func(target, creds, env):
+            if first(target, creds, env):
+                return True
+            return True if second(target, creds, env) else False
+    else:
+        def func(target, creds, env):
+            for check in funcs:
+                if check(target, creds, env):
+                    return True
+            return False
+    return _Node(func, deps=_deps(nodes))
+
+
+def _compile_bool(node):
+    inner = node.func
+
+    def func(target, creds, env):
+        return True if inner(target, creds, env) else False
+    return _Node(func, deps=node.deps, leaf=node.leaf)
+
+
+def _guard(node):
+    """Fail closed on KeyError, as RuleCheck does in the interpreter."""
+    if node.const is not None:
+        return node
+    inner = node.func
+
+    def func(target, creds, env):
+        try:
+            return inner(target, creds, env)
+        except KeyError:
+            return False
+    return _Node(func, is_bool=node.is_bool, deps=node.deps, leaf=node.leaf)
+
+
+def _memoize(token, name, node):
+    """Evaluate a named rule at most once per memo table and target."""
+    if node.leaf:
+        return node
+    inner = node.func
+    by_target = bool(node.deps & frozenset([TARGET, EXTERNAL]))
+
+    def func(target, creds, env):
+        memo = env.memo
+        if memo is None:
+            return inner(target, creds, env)
+        if by_target:
+            target_key = env.target_key
+            if target_key is _MISSING:
+                target_key = env.target_key = _target_key(target)
+            key = (token, name, target_key)
+        else:
+            key = (token, name, env.target_is_dict)
+        result = memo.get(key, _MISSING)
+        if result is _MISSING:
+            result = memo[key] = inner(target, creds, env)
+        return result
+    return _Node(func, is_bool=node.is_bool, deps=node.deps)
+
+
+class _Compiler(object):
+
+    def __init__(self, rules, nodes=None, refs=None):
+        """
+        :param rules: The Rules object to compile.
+        :param nodes: Nodes compiled before for rules of the same name,
+                      which are still valid for these rules.
+        :param refs: Names referenced by the rules of those nodes.
+        """
+        self.rules = rules
+        self.nodes = dict(nodes or {})
+        self.refs = dict(refs or {})
+        self.pending = set()
+        self.stack = []
+        self.token = object()
+
+    def rule(self, name):
+        """Return the compiled node for the named rule."""
+        node = self.nodes.get(name)
+        if node is not None:
+            return node
+        if name in self.pending:
+            # NOTE: A reference cycle; the interpreter recurses until the
+            # stack is exhausted, so do the same through a late lookup.
+            nodes = self.nodes
+
+            def func(target, creds, env):
+                return nodes[name].func(target, creds, env)
+            return _Node(func, is_bool=False, deps=frozenset([EXTERNAL]))
+        self.pending.add(name)
+        self.stack.append(name)
+        self.refs[name] = set()
+        try:
+            node = _memoize(self.token, name, self.check(self.rules[name]))
+        finally:
+            self.stack.pop()
+            self.pending.discard(name)
+        self.nodes[name] = node
+        return node
+
+    def missing(self):
+        """Return what Rules.__missing__ resolves an unknown name to."""
+        default = self.rules.default_rule
+        if not default:
+            return _FALSE
+        if isinstance(default, _checks.BaseCheck):
+            return self.check(default)
+        if (isinstance(default, six.string_types) and
+                default in self.rules):
+            return self.rule(default)
+        return _FALSE
+
+    def reference(self, name):
+        """Link a ``rule:`` reference to the compiled referenced rule."""
+        if self.stack:
+            # NOTE: Record the reference even when the name is unknown, so
+            # the rule gets relinked if a rule of that name is added.
+            refs = self.refs[self.stack[-1]]
+            refs.add(name)
+            if (name not in self.rules and
+                    isinstance(self.rules.default_rule, six.string_types)):
+                refs.add(self.rules.default_rule)
+        if name in self.rules:
+            return _guard(self.rule(name))
+        return _guard(self.missing())
+
+    def check(self, check):
+        cls = type(check)
+        if cls is _checks.TrueCheck:
+            return _TRUE
+        if cls is _checks.FalseCheck:
+            return _FALSE
+        if cls is _checks.NotCheck:
+            return _compile_not(self.check(check.rule))
+        if cls is _checks.AndCheck:
+            return _compile_and(self._flatten(check, cls))
+        if cls is _checks.OrCheck:
+            return _compile_or(self._flatten(check, cls))
+        if cls is _checks.RuleCheck:
+            return self.reference(check.match)
+        if cls is _checks.RoleCheck:
+            return _compile_role(check)
+        if cls is _checks.GenericCheck:
+            return _compile_generic(check)
+        return _fallback(check)
+
+    def _flatten(self, check, cls):
+        nodes = []
+        for child in check.rules:
+            if type(child) is cls:
+                nodes.extend(self._flatten(child, cls))
+            else:
+                nodes.append(self.check(child))
+        return nodes
+
+
+def references(rules):
+    """Return the names each rule of a rule set refers to.
+
+    Like the compiler, a reference to an unknown name is also recorded as a
+    reference to the default rule it resolves to.
+
+    :param rules: The oslo.policy Rules object.
+    :returns: dict of rule name: set of referenced names.
+    """
+    default = rules.default_rule
+
+    def walk(check, refs):
+        cls = type(check)
+        if cls is _checks.NotCheck:
+            walk(check.rule, refs)
+        elif cls in (_checks.AndCheck, _checks.OrCheck):
+            for child in check.rules:
+                walk(child, refs)
+        elif cls is _checks.RuleCheck:
+            refs.add(check.match)
+            if (check.match not in rules and
+                    isinstance(default, six.string_types)):
+                refs.add(default)
+        return refs
+
+    return dict((name, walk(rule, set())) for name, rule in rules.items())
+
+
+def dependents(refs, names):
+    """Return the names of the rules depending on any of the given ones.
+
+    :param refs: dict of rule name: names it refers to, as returned by
+                 references().
+    :param names: Names of rules, which are included in the result along
+                  with every rule referencing one of them through any chain
+                  of ``rule:`` references.
+    """
+    users = {}
+    for name, referenced in refs.items():
+        for ref in referenced:
+            users.setdefault(ref, set()).add(name)
+    affected = set(names)
+    pending = list(affected)
+    while pending:
+        for name in users.get(pending.pop(), ()):
+            if name not in affected:
+                affected.add(name)
+                pending.append(name)
+    return affected
+
+
+def _classify(node):
+    """Return the kind of a rule from what its compiled node depends on."""
+    deps = node.deps - frozenset([TARGET_TYPE])
+    if node.const is not None or not deps:
+        return CONSTANT
+    if EXTERNAL in deps:
+        return DELEGATED
+    if TARGET in deps:
+        return CONDITIONAL
+    if CREDS in deps:
+        return CREDENTIALS
+    return ROLE
+
+
+class CompiledRules(object):
+    """A rule set compiled into directly callable decision functions.
+
+    Rules which only depend on the roles of the caller, or on nothing at all,
+    are also answered from a decision matrix: one row per distinct role set
+    seen, holding the outcome of all those rules as a bitmask, so that such a
+    decision is a dict lookup and a bitwise and.
+
+    A rule set may be compiled from an earlier version of itself, in which
+    case only the changed rules and the rules referencing them, directly or
+    not, are compiled again, and only their columns of the decision matrix
+    are recomputed.
+    """
+
+    def __init__(self, rules, role_sets=0, previous=None, changed=None):
+        """
+        :param rules: The oslo.policy Rules object to compile. The compiled
+                      rules are a snapshot and must be rebuilt whenever the
+                      Rules object changes.
+        :param role_sets: Maximum number of role sets with a row in the
+                          decision matrix, 0 disables the matrix.
+        :param previous: CompiledRules of an earlier version of the rules.
+        :param changed: Names of the rules added, removed or modified since
+                        that earlier version.
+        """
+        if (previous is not None and
+                previous.default_rule == rules.default_rule):
+            self.affected = previous.dependents(changed)
+            compiler = _Compiler(
+                rules,
+                nodes=dict((name, node) for name, node in
+                           previous.nodes.items()
+                           if name not in self.affected),
+                refs=dict((name, refs) for name, refs in
+                          previous.refs.items()
+                          if name not in self.affected))
+        else:
+            # NOTE: None stands for every rule.
+            self.affected = None
+            previous = None
+            compiler = _Compiler(rules)
+        self.nodes = dict((name, compiler.rule(name)) for name in rules)
+        self.refs = dict((name, compiler.refs.get(name, frozenset()))
+                         for name in rules)
+        self.funcs = dict((name, node.func)
+                          for name, node in self.nodes.items())
+        self.kinds = dict((name, _classify(node))
+                          for name, node in self.nodes.items())
+        self.missing = compiler.missing().func
+        self.default_rule = rules.default_rule
+        self.empty = not rules
+
+        # NOTE: Columns of the decision matrix, as name: (mask, any_target).
+        # Rows are computed for dict targets; a column whose rule formats
+        # its match with the target only answers for dict targets.
+        static = sorted(name for name, kind in self.kinds.items()
+                        if kind in (CONSTANT, ROLE))
+        kept = {}
+        if previous is not None and previous.rows is not None:
+            kept = dict((name, previous.columns[name]) for name in static
+                        if name in previous.columns and
+                        name not in self.affected)
+        used = 0
+        for mask, any_target in kept.values():
+            used |= mask
+        kept_mask = used
+        self.columns = dict(kept)
+        fresh = {}
+        bit = 0
+        for name in static:
+            if name in kept:
+                continue
+            while used & (1 << bit):
+                bit += 1
+            used |= 1 << bit
+            fresh[name] = (1 << bit,
+                           TARGET_TYPE not in self.nodes[name].deps)
+        self.columns.update(fresh)
+
+        self.rows = None
+        if role_sets > 0 and static:
+            self.rows = cache.LRUCache(role_sets)
+            if kept:
+                for roles, row in previous.rows.items():
+                    row = self._fill(row & kept_mask, roles, fresh)
+                    self.rows.set(roles, row)
+
+    def __len__(self):
+        return len(self.funcs)
+
+    def dependents(self, names):
+        """Return the names of the rules depending on any of the given ones.
+
+        The given names are included, as well as every rule referencing one
+        of them through any chain of ``rule:`` references.
+        """
+        return dependents(self.refs, names)
+
+    def _fill(self, row, roles, columns, creds=None, enforcer=None):
+        """Set the bits of a matrix row for the given columns."""
+        target = {}
+        if creds is None:
+            creds = {'roles': list(roles)}
+        env = _Env(target, creds, enforcer, None)
+        for name, (mask, any_target) in columns.items():
+            try:
+                if self.funcs[name](target, creds, env):
+                    row |= mask
+            except KeyError:
+                pass
+        return row
+
+    def _row(self, roles, creds, enforcer):
+        """Return the decision matrix row of a role set."""
+        row = self.rows.get(roles)
+        if row is None:
+            row = self._fill(0, roles, self.columns, creds, enforcer)
+            self.rows.set(roles, row)
+        return row
+
+    def enforce(self, rule, target, creds, enforcer, memo=None):
+        """Evaluate a rule the way oslo.policy's Enforcer.enforce does.
+
+        :param rule: Name of the rule to evaluate.
+        :param target: Dictionary representing the object of the action.
+        :param creds: Dictionary of the credentials of the caller.
+        :param enforcer: The enforcer owning the rules, handed to checks the
+                         compiler delegates back to oslo.policy.
+        :param memo: Optional dict remembering the outcome of named rules.
+                     It must only be shared by decisions made for the same
+                     credentials.
+        :returns: A non-False value if access is allowed.
+        """
+        if self.empty:
+            return False
+        env = _Env(target, creds, enforcer, memo)
+        if self.rows is not None and env.roles is not None:
+            column = self.columns.get(rule)
+            if column is not None and (column[1] or env.target_is_dict):
+                row = self._row(env.roles, creds, enforcer)
+                return True if row & column[0] else False
+        func = self.funcs.get(rule, self.missing)
+        try:
+            return func(target, creds, env)
+        except KeyError:
+            return False
+
+    def analysis(self):
+        """Describe the rules by kind and the size of the decision matrix."""
+        rules = dict((kind, []) for kind in KINDS)
+        for name, kind in self.kinds.items():
+            rules[kind].append(name)
+        for names in rules.values():
+            names.sort()
+        matrix = {
+            'enabled': self.rows is not None,
+            'columns': len(self.columns),
+            'rows': 0,
+            'bytes': 0,
+        }
+        if self.rows is not None:
+            matrix.update(self.rows.stats())
+            matrix['rows'] = len(self.rows)
+            matrix['bytes'] = len(self.rows) * ((len(self.columns) + 7) // 8)
+        return {
+            'counts': dict((kind, len(names))
+                           for kind, names in rules.items()),
+            'rules': rules,
+            'matrix': matrix,
+        }
@@ -0,0 +1,127 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Trace the evaluation of an oslo.policy rule, check by check.
+
+The tracer walks the check tree the way the oslo.policy interpreter does,
+short-circuiting and/or checks in the same order, and reports every check it
+evaluated with its result and the time spent in it. Checks an and/or check
+did not need to evaluate are listed as skipped, so the trace also shows which
+check decided.
+"""
+
+import timeit
+
+from oslo_policy import _checks
+import six
+
+_timer = timeit.default_timer
+
+
+def _kind(check):
+    name = type(check).__name__
+    if name.endswith('Check'):
+        name = name[:-len('Check')]
+    return name.lower()
+
+
+def _skipped(check):
+    return {'check': six.text_type(check), 'kind': _kind(check),
+            'evaluated': False}
+
+
+class _Tracer(object):
+
+    def __init__(self, rules, target, creds, enforcer):
+        self.rules = rules
+        self.target = target
+        self.creds = creds
+        self.enforcer = enforcer
+        self.stack = []
+
+    def trace(self, check):
+        """Evaluate a check and return (result, trace node)."""
+        node = {'check': six.text_type(check), 'kind': _kind(check),
+                'evaluated': True}
+        start = _timer()
+        try:
+            result = self._evaluate(check, node)
+        except KeyError:
+            # NOTE: The interpreter fails closed on a missing key.
+            result = False
+            node['error'] = 'KeyError'
+        node['result'] = bool(result)
+        node['elapsed_ns'] = int((_timer() - start) * 1e9)
+        return result, node
+
+    def _evaluate(self, check, node):
+        cls = type(check)
+        if cls is _checks.NotCheck:
+            result, child = self.trace(check.rule)
+            node['children'] = [child]
+            return not result
+        if cls in (_checks.AndCheck, _checks.OrCheck):
+            # NOTE: An and check stops at the first False, an or check at
+            # the first True.
+            stop = cls is _checks.OrCheck
+            node['children'] = children = []
+            rules = check.rules
+            for index, rule in enumerate(rules):
+                result, child = self.trace(rule)
+                children.append(child)
+                if bool(result) is stop:
+                    if index + 1 < len(rules):
+                        child['short_circuit'] = True
+                        children.extend(_skipped(rule)
+                                        for rule in rules[index + 1:])
+                    return stop
+            return not stop
+        if cls is _checks.RuleCheck:
+            return self.reference(check.match, node)
+        return check(self.target, self.creds, self.enforcer)
+
+    def reference(self, name, node):
+        node['rule'] = name
+        if name not in self.rules:
+            node['default'] = True
+        if name in self.stack:
+            node['error'] = 'reference cycle'
+            return False
+        self.stack.append(name)
+        try:
+            result, child = self.trace(self.rules[name])
+        finally:
+            self.stack.pop()
+        node['children'] = [child]
+        return result
+
+
+def explain(rules, rule, target, creds, enforcer):
+    """Evaluate a rule and trace every check evaluated on the way.
+
+    :param rules: The oslo.policy Rules object holding the rule.
+    :param rule: Name of the rule to evaluate.
+    :param target: Dictionary representing the object of the action.
+    :param creds: Dictionary of the credentials of the caller.
+    :param enforcer: The enforcer owning the rules.
+    :returns: A (result, trace) tuple. Every node of the trace holds the
+              text of its check, its kind, whether it was evaluated and, if
+              so, its result and the nanoseconds spent evaluating it.
+    """
+    if not rules:
+        return False, None
+    tracer = _Tracer(rules, target, creds, enforcer)
+    return tracer.trace(_checks.RuleCheck('rule', rule))
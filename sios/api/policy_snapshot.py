@@ -0,0 +1,134 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Export oslo.policy rules as a snapshot the policy shims evaluate themselves.
+
+Every check tree is lowered to nested JSON lists, resolved the way the
+oslo.policy interpreter would resolve it: references to unknown rules are
+linked to the default rule, nested and/or checks are flattened, role matches
+are lowercased and the kind of generic checks is parsed into a literal or a
+credentials path. The shims then need no policy library of their own, and
+cannot give a different meaning to a check than SIOS does.
+
+The nodes of a snapshot are::
+
+    true, false
+    ["not", node]
+    ["and", node, ...], ["or", node, ...]
+    ["rule", name]
+    ["role", role]
+    ["generic", {"literal": text} or {"path": [key, ...]}, match]
+    ["external", text]
+
+External nodes stand for checks only SIOS can evaluate, such as http checks;
+a decision reaching one must be asked to SIOS.
+"""
+
+import ast
+import hashlib
+
+from oslo_policy import _checks
+from oslo_serialization import jsonutils
+import six
+
+
+def _external(check):
+    return ['external', six.text_type(check)]
+
+
+class _Exporter(object):
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def missing(self):
+        """Return what Rules.__missing__ resolves an unknown name to."""
+        default = self.rules.default_rule
+        if not default or isinstance(default, dict):
+            return False
+        if isinstance(default, _checks.BaseCheck):
+            return self.check(default)
+        if (isinstance(default, six.string_types) and
+                default in self.rules):
+            return ['rule', default]
+        return False
+
+    def reference(self, name):
+        if name in self.rules:
+            return ['rule', name]
+        return self.missing()
+
+    def check(self, check):
+        cls = type(check)
+        if cls is _checks.TrueCheck:
+            return True
+        if cls is _checks.FalseCheck:
+            return False
+        if cls is _checks.NotCheck:
+            return ['not', self.check(check.rule)]
+        if cls in (_checks.AndCheck, _checks.OrCheck):
+            name = 'and' if cls is _checks.AndCheck else 'or'
+            return [name] + [self.check(child)
+                             for child in self._flatten(check, cls)]
+        if cls is _checks.RuleCheck:
+            return self.reference(check.match)
+        if cls is _checks.RoleCheck:
+            return ['role', check.match.lower()]
+        if cls is _checks.GenericCheck:
+            return self.generic(check)
+        return _external(check)
+
+    def generic(self, check):
+        try:
+            left = {'literal': six.text_type(ast.literal_eval(check.kind))}
+        except ValueError:
+            left = {'path': check.kind.split('.')}
+        except Exception:
+            # NOTE: The interpreter raises on such a kind, let SIOS do so.
+            return _external(check)
+        return ['generic', left, check.match]
+
+    def _flatten(self, check, cls):
+        checks = []
+        for child in check.rules:
+            if type(child) is cls:
+                checks.extend(self._flatten(child, cls))
+            else:
+                checks.append(child)
+        return checks
+
+
+def export(rules, service=None):
+    """Lower a rule set into a snapshot the policy shims can evaluate.
+
+    :param rules: The oslo.policy Rules object to export.
+    :param service: Name of the service the rules belong to.
+    :returns: dict with the service, the lowered 'rules', the 'default'
+              node deciding unknown actions, and a 'version' which is a
+              digest of all of them, so equal rules get the same version
+              on every worker and every SIOS server.
+    """
+    exporter = _Exporter(rules)
+    snapshot = {
+        'service': service,
+        'rules': dict((name, exporter.check(rule))
+                      for name, rule in rules.items()),
+        # NOTE: Without rules the interpreter fails closed.
+        'default': exporter.missing() if rules else False,
+    }
+    digest = hashlib.sha256(jsonutils.dumps(snapshot, sort_keys=True))
+    snapshot['version'] = digest.hexdigest()
+    return snapshot
@@ -0,0 +1,165 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Credential sessions for PDP callers.
+
+A caller whose token has been validated once may exchange it for a session
+handle, then send that handle alone in the X-PDP-Session header of later
+decision requests. The handle carries the user, tenant and roles of the
+caller and their expiry, signed with HMAC-SHA256, so any API worker can
+verify it without validating a token or sharing state with the others.
+
+Handles cannot be revoked; they expire with the token they were created from,
+or after the session TTL if that comes first.
+"""
+
+import base64
+import calendar
+import hashlib
+import hmac
+import os
+import time
+
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+
+from sios.common import cache
+from sios.common import exception
+from sios import i18n
+
+_ = i18n._
+
+session_opts = [
+    cfg.StrOpt('secret', secret=True,
+               help=_('Key signing the PDP session handles. It must be the '
+                      'same on every SIOS server sharing the sessions of '
+                      'its callers. When unset, a random key is generated '
+                      'when the server starts, and sessions do not survive '
+                      'a restart.')),
+    cfg.IntOpt('ttl', default=3600,
+               help=_('Maximum number of seconds a PDP session lasts. A '
+                      'session never outlives the token it was created '
+                      'from.')),
+    cfg.IntOpt('cache_size', default=10000,
+               help=_('Number of verified session handles each API worker '
+                      'remembers, so that their signature is only checked '
+                      'once. Set to 0 to check it on every request.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(session_opts, group='session')
+
+HEADER = 'X-PDP-Session'
+
+# NOTE: Generated before the API workers are forked, so they all share it.
+_RANDOM_KEY = os.urandom(32)
+
+_verified = None
+
+
+def _key():
+    secret = CONF.session.secret
+    if secret:
+        return secret.encode('utf-8')
+    return _RANDOM_KEY
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(str(data) + '=' * (-len(data) % 4))
+
+
+def _sign(payload):
+    return hmac.new(_key(), payload, hashlib.sha256).digest()
+
+
+def token_expiry(token_info):
+    """Return when a token validated by authtoken expires, as a timestamp.
+
+    :param token_info: The token data authtoken stores in the WSGI
+                       environment, from the v2 or v3 identity API.
+    :returns: Seconds since the epoch, or None if unknown.
+    """
+    if not token_info:
+        return None
+    try:
+        if 'access' in token_info:
+            expires = token_info['access']['token']['expires']
+        else:
+            expires = token_info['token']['expires_at']
+        expires = timeutils.normalize_time(timeutils.parse_isotime(expires))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return calendar.timegm(expires.utctimetuple())
+
+
+def create(user, tenant, roles, token_expires=None):
+    """Return a signed session handle for a set of credentials.
+
+    :param token_expires: When the token of the credentials expires, as a
+                          timestamp, if known.
+    :returns: A (handle, expires) tuple, expires being a timestamp.
+    """
+    expires = int(time.time()) + CONF.session.ttl
+    if token_expires is not None:
+        expires = min(expires, int(token_expires))
+    payload = jsonutils.dumps([user, tenant, list(roles), expires])
+    handle = '%s.%s' % (_b64encode(payload), _b64encode(_sign(payload)))
+    return handle, expires
+
+
+def verify(handle):
+    """Return the credentials a session handle was created for.
+
+    :returns: dict with the user, tenant and roles of the session
+    :raises: `sios.common.exception.InvalidSession` if the handle is
+             forged, malformed or expired
+    """
+    global _verified
+    if _verified is None and CONF.session.cache_size > 0:
+        _verified = cache.LRUCache(CONF.session.cache_size)
+    credentials = None
+    if _verified is not None:
+        credentials = _verified.get(handle)
+    if credentials is None:
+        credentials = _decode(handle)
+        if _verified is not None:
+            _verified.set(handle, credentials)
+    if credentials['expires'] <= time.time():
+        raise exception.InvalidSession(reason=_('it has expired'))
+    return credentials
+
+
+def _decode(handle):
+    try:
+        payload, signature = handle.split('.')
+        payload = _b64decode(payload)
+        signature = _b64decode(signature)
+    except (ValueError, TypeError, UnicodeError):
+        raise exception.InvalidSession(reason=_('it is malformed'))
+    if not hmac.compare_digest(_sign(payload), signature):
+        raise exception.InvalidSession(
+            reason=_('its signature does not match'))
+    try:
+        user, tenant, roles, expires = jsonutils.loads(payload)
+    except ValueError:
+        raise exception.InvalidSession(reason=_('it is malformed'))
+    return {'user': user, 'tenant': tenant, 'roles': roles,
+            'expires': expires}
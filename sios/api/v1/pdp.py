@@ -21,6 +21,7 @@
 import copy
 import eventlet
 from oslo_config import cfg
+from oslo_serialization import jsonutils
 from webob.exc import (HTTPError,
                        HTTPNotFound,
                        HTTPConflict,
@@ -28,20 +29,67 @@ from webob.exc import (HTTPError,
                        HTTPForbidden,
                        HTTPRequestEntityTooLarge,
                        HTTPInternalServerError,
+                       HTTPNotModified,
                        HTTPServiceUnavailable)
 from webob import Response
 from sios.api import policy
+from sios.api import session
 import sios.api.v1
+from sios.common import cache
 from sios.common import exception
+from sios.common import metrics
 from sios.common import utils
 from sios.common import wsgi
 from oslo_utils import strutils
+from oslo_utils import timeutils
 import oslo_log.log as logging
+import six
 from sios.i18n import _
 
+decision_cache_opts = [
+    cfg.IntOpt('size', default=10000,
+               help=_('Maximum number of policy decisions cached by each '
+                      'API worker. Set to 0 to disable the cache.')),
+    cfg.IntOpt('ttl', default=60,
+               help=_('Number of seconds a cached policy decision may be '
+                      'served for. Cached decisions are also dropped as '
+                      'soon as the policy rules are reloaded.')),
+    cfg.ListOpt('endpoints',
+                default=['check_glance', 'enforce_glance',
+                         'permissions_glance', 'check_nova',
+                         'enforce_nova', 'permissions_nova'],
+                help=_('PDP endpoints whose decisions are cached, named '
+                       '<mode>_<service>, for example enforce_nova or '
+                       'permissions_nova.')),
+]
+
+pdp_opts = [
+    cfg.IntOpt('max_batch_size', default=100,
+               help=_('Maximum number of decisions that may be requested '
+                      'in one call to the PDP batch endpoint.')),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(decision_cache_opts, group='decision_cache')
+CONF.register_opts(pdp_opts)
 LOG = logging.getLogger(__name__)
 
+_MISSING = object()
+
+MODES = ('check', 'enforce')
+
+
+def _canonical_target(target):
+    """Return a hashable representation of a policy target."""
+    if isinstance(target, dict):
+        return jsonutils.dumps(target, sort_keys=True)
+    return target
+
+
+def _roles_key(roles):
+    """Return the same cache key part for the same set of roles."""
+    return tuple(sorted(set(roles)))
+
 
 class Controller(object):
     """
@@ -50,58 +98,275 @@ class Controller(object):
     The PDP resource API is a RESTful web service for Policy Decisions. The API
     is as follows::
 
-        POST /check -- check the Policy Decision
-        POST /enforce -- check the Policy Decision to be enforced
+        POST /{service}/check -- check the Policy Decision
+        POST /{service}/enforce -- check the Policy Decision to be enforced
+        POST /batch -- check several Policy Decisions in one call
+        POST /sessions -- exchange the caller's token for a PDP session
+        GET /{service}/permissions -- list the actions allowed to the caller
+        GET /{service}/analysis -- classify the policy rules of a service
+        GET /{service}/snapshot -- export the policy rules of a service for
+                                   evaluation by the policy shims
+        GET /cache -- report the decision cache counters
+
+    The decision resources also return the evaluated check tree of each
+    decision, with per check results and timings, when the request has an
+    X-PDP-Explain header or an explain query parameter set to true.
+
+    The older /check_glance, /enforce_glance and /enforce_nova resources are
+    kept as aliases of the per-service ones.
     """
 
     def __init__(self):
-        self.policy = policy.Enforcer()
         self.pool = eventlet.GreenPool(size=1024)
-   
+        self.cached_endpoints = frozenset(CONF.decision_cache.endpoints)
+        self.caches = {}
+        self.cache_versions = {}
+        self.metrics = CONF.metrics.enabled
+
+    def _get_cache(self, service, endpoint, enforcer):
+        """Return the decision cache for an endpoint, if it has one.
+
+        Each service has its own cache. When the policy rules of that
+        service have been reloaded since it was last used, the decisions
+        made with the rules which changed are dropped, and so are the
+        permission lists.
+        """
+        if (CONF.decision_cache.size <= 0 or
+                endpoint not in self.cached_endpoints):
+            return None
+        version = enforcer.get_version()
+        decisions = self.caches.get(service)
+        if decisions is None:
+            decisions = cache.LRUCache(CONF.decision_cache.size,
+                                       ttl=CONF.decision_cache.ttl)
+            self.caches[service] = decisions
+        elif version != self.cache_versions.get(service):
+            changed = enforcer.changed_since(self.cache_versions.get(service))
+            if changed is None:
+                decisions.clear()
+            else:
+                permissions = 'permissions_%s' % service
+                decisions.prune(lambda key: (key[0] == permissions or
+                                             key[1] in changed))
+        self.cache_versions[service] = version
+        return decisions
+
+    def decision(self, context, service, mode, action, target):
+        """Answer a PDP request, from the decision cache when possible.
+
+        :param context: Sios request context of the caller
+        :param service: Name of the service whose policy applies
+        :param mode: 'enforce' or 'check'
+        :param action: String representing the action to be checked
+        :param target: The object of the action
+        """
+        if not self.metrics:
+            return self._evaluate(context, service, mode, action, target)
+        with metrics.Timer(metrics.PDP_DECISION_SECONDS,
+                           (service, mode, 'other')) as timer:
+            pdp_decision = self._evaluate(context, service, mode, action,
+                                          target)
+            # NOTE: Labelled once the rules are loaded, see _action_label.
+            timer.labels = (service, mode,
+                            self._action_label(service, action))
+        metrics.PDP_DECISIONS.inc(
+            (service, mode, 'allow' if pdp_decision else 'deny'))
+        return pdp_decision
+
+    def _action_label(self, service, action):
+        """Label the metrics of an action.
+
+        Only the rules of the loaded policy get a label of their own, so
+        that callers cannot create series at will; any other action is
+        labelled 'other'.
+        """
+        try:
+            if action in policy.get_enforcer(service).rules:
+                return action
+        except TypeError:
+            pass
+        return 'other'
+
+    def _evaluate(self, context, service, mode, action, target):
+        LOG.debug('Evaluating Policy decision for action [%s]', action)
+        enforcer = policy.get_enforcer(service)
+        endpoint = '%s_%s' % (mode, service)
+        decisions = self._get_cache(service, endpoint, enforcer)
+        if decisions is not None:
+            key = (endpoint, action, context.user, context.tenant,
+                   _roles_key(context.roles), _canonical_target(target))
+            pdp_decision = decisions.get(key, _MISSING)
+            if self.metrics:
+                metrics.PDP_CACHE.inc(
+                    (service, 'miss' if pdp_decision is _MISSING else 'hit'))
+            if pdp_decision is not _MISSING:
+                LOG.debug('The cached Policy decision for action [%s] is '
+                          '[%s]', action, pdp_decision)
+                return pdp_decision
+        evaluate = getattr(enforcer, mode)
+        try:
+            pdp_decision = evaluate(context, action, target)
+        except exception.Forbidden:
+            LOG.debug('Exception Raised for action [%s]', action)
+            pdp_decision = False
+        if decisions is not None:
+            decisions.set(key, pdp_decision)
+        LOG.debug('The Policy decision for action [%s] is [%s]',
+                  action, pdp_decision)
+        return pdp_decision
+
+    def _check_service(self, req, service):
+        if service not in CONF.service_policy_files:
+            msg = _('No policy is defined for service %s.') % service
+            raise HTTPNotFound(explanation=msg, request=req,
+                               content_type='text/plain')
+
+    def _explain_requested(self, req):
+        value = req.headers.get('X-PDP-Explain', req.GET.get('explain'))
+        return strutils.bool_from_string(value)
+
+    def decide(self, req, service, mode):
+        """Authorize an action against the policies of a service"""
+        self._check_service(req, service)
+        context = req.context
+        pdp_decision = self.decision(context, service, mode,
+                                    context.action, context.target)
+        if not self._explain_requested(req):
+            return pdp_decision
+        enforcer = policy.get_enforcer(service)
+        return {
+            'decision': pdp_decision,
+            'explain': enforcer.explain(context, context.action,
+                                        context.target),
+        }
+
     """
     PDP for glance OpenStack Service
     """
     def enforce_glance(self, req):
         """Authorize an action against our policies"""
-        try:
-	    LOG.debug(_('Evaluating Policy decision for action [%s]') % req.context.action)
-            pdp_decision = self.policy.enforce(req.context, req.context.action, req.context.target)
-	    LOG.debug(_('The Policy decision for action [%s] is [%s]') % (req.context.action, pdp_decision))
-   	    return pdp_decision
-        except exception:
-	    LOG.debug(_('Exception Raised for action [%s]') % req.context.action)
-	    LOG.debug(_('The Policy decision for action [%s] is [False]') % req.context.action)
-	    LOG.debug(exception)
-            return False
+        return self.decide(req, 'glance', 'enforce')
 
     def check_glance(self, req):
         """Authorize an action against our policies"""
-        try:
-	    LOG.debug(_('Evaluating Policy decision for action [%s]') % req.context.action)
-            pdp_decision = self.policy.check(req.context, req.context.action, req.context.target)
-	    LOG.debug(_('The Policy decision for action [%s] is [%s]') % (req.context.action, pdp_decision))
-   	    return pdp_decision
-        except exception:
-	    LOG.debug(_('Exception Raised for action [%s]') % req.context.action)
-	    LOG.debug(_('The Policy decision for action [%s] is [False]') % req.context.action)
-	    LOG.debug(exception)
-            return False
+        return self.decide(req, 'glance', 'check')
 
     """
     PDP for nova OpenStack Service
     """
     def enforce_nova(self, req):
         """Authorize an action against our policies"""
-        try:
-	    LOG.debug(_('Evaluating Policy decision for action [%s]') % req.context.action)
-            pdp_decision =  self.policy.enforce(req.context, req.context.action, req.context.target)
-	    LOG.debug(_('The Policy decision for action [%s] is [%s]') % (req.context.action, pdp_decision))
-	    return pdp_decision
-        except exception:
-	    LOG.debug(_('Exception Raised for action [%s]') % req.context.action)
-	    LOG.debug(_('The Policy decision for action [%s] is [False]') % req.context.action)
-	    LOG.debug(exception)
-            return False
+        return self.decide(req, 'nova', 'enforce')
+
+    def batch(self, req, items):
+        """Authorize several actions for the caller in one request.
+
+        :param req: The request carrying the credentials of the caller
+        :param items: List of dicts with a 'service', an 'action', an
+                      optional 'target' and an optional 'mode' which is
+                      either 'enforce' (the default) or 'check'
+        :returns: dict with the decisions, in the order of the items
+        """
+        if len(items) > CONF.max_batch_size:
+            msg = (_('A batch may hold at most %(max)d decisions, got '
+                     '%(count)d.') % {'max': CONF.max_batch_size,
+                                      'count': len(items)})
+            raise HTTPRequestEntityTooLarge(explanation=msg,
+                                            request=req,
+                                            content_type='text/plain')
+        decisions = []
+        for item in items:
+            service = item.get('service')
+            mode = item.get('mode', 'enforce')
+            if (service not in CONF.service_policy_files or
+                    mode not in MODES):
+                msg = (_('Unsupported service and mode %s/%s in batch.') %
+                       (service, mode))
+                raise HTTPBadRequest(explanation=msg, request=req,
+                                     content_type='text/plain')
+            decisions.append(self.decision(req.context, service, mode,
+                                          item['action'],
+                                          item.get('target', {})))
+        result = {'decisions': decisions}
+        if self._explain_requested(req):
+            result['explain'] = [
+                policy.get_enforcer(item['service']).explain(
+                    req.context, item['action'], item.get('target', {}))
+                for item in items]
+        return result
+
+    def permissions(self, req, service):
+        """List the actions of a service allowed for the caller.
+
+        Actions whose rule depends on the target are listed as conditional.
+        The result is cached per set of credentials until the policy of the
+        service is reloaded.
+        """
+        self._check_service(req, service)
+        context = req.context
+        enforcer = policy.get_enforcer(service)
+        endpoint = 'permissions_%s' % service
+        decisions = self._get_cache(service, endpoint, enforcer)
+        if decisions is not None:
+            key = (endpoint, context.user, context.tenant,
+                   _roles_key(context.roles))
+            result = decisions.get(key)
+            if result is not None:
+                return result
+        result = enforcer.permissions(context)
+        if decisions is not None:
+            decisions.set(key, result)
+        return result
+
+    def create_session(self, req):
+        """Create a session handle for the credentials of the caller.
+
+        Later requests may send the handle in the X-PDP-Session header
+        instead of a token. The session expires with the token.
+        """
+        context = req.context
+        if not context.auth_token:
+            msg = _('A PDP session can only be created with a token.')
+            raise HTTPForbidden(explanation=msg, request=req,
+                                content_type='text/plain')
+        token_expires = session.token_expiry(
+            req.environ.get('keystone.token_info'))
+        handle, expires = session.create(context.user, context.tenant,
+                                         context.roles, token_expires)
+        return {
+            'session': handle,
+            'expires_at': timeutils.iso8601_from_timestamp(expires),
+        }
+
+    def analysis(self, req, service):
+        """Report how the policy rules of a service can be evaluated"""
+        self._check_service(req, service)
+        return policy.get_enforcer(service).analyze()
+
+    def snapshot(self, req, service):
+        """Export the policy rules of a service for the policy shims.
+
+        The ETag of the snapshot is its version, so shims polling it with
+        If-None-Match only download it again once the rules have changed.
+        """
+        self._check_service(req, service)
+        snapshot = policy.get_enforcer(service).snapshot()
+        if snapshot['version'] in req.if_none_match:
+            raise HTTPNotModified(
+                headers=[('ETag', '"%s"' % snapshot['version'])])
+        return snapshot
+
+    def cache_stats(self, req):
+        """Report the counters of this worker's decision caches"""
+        if CONF.decision_cache.size <= 0:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'endpoints': sorted(self.cached_endpoints),
+            'services': dict((service, decisions.stats()) for
+                             service, decisions in self.caches.items()),
+        }
+
 
 class Deserializer(wsgi.JSONRequestDeserializer):
     """Handles deserialization of specific controller method requests."""
@@ -116,6 +381,26 @@ class Deserializer(wsgi.JSONRequestDeserializer):
     def update(self, request):
         return self._deserialize(request)
 
+    def create_session(self, request):
+        return {}
+
+    def batch(self, request):
+        body = self.default(request).get('body')
+        items = body.get('items') if isinstance(body, dict) else None
+        if not isinstance(items, list):
+            msg = _('Batch body must be an object with a list of items.')
+            raise HTTPBadRequest(explanation=msg, request=request,
+                                 content_type='text/plain')
+        for item in items:
+            if (not isinstance(item, dict) or
+                    not isinstance(item.get('action'), six.string_types) or
+                    not isinstance(item.get('target', {}), dict)):
+                msg = _('Each batch item needs an action and may only have '
+                        'an object as target.')
+                raise HTTPBadRequest(explanation=msg, request=request,
+                                     content_type='text/plain')
+        return {'items': items}
+
 
 class Serializer(wsgi.JSONResponseSerializer):
     """Handles serialization of specific controller method responses."""
@@ -135,9 +420,25 @@ class Serializer(wsgi.JSONResponseSerializer):
     def create(self, response, result):
        return response
 
+    def snapshot(self, response, result):
+        self.default(response, result)
+        response.etag = result['version']
+        return response
+
+
+_CONTROLLER = None
+
+
+def get_controller():
+    """Return the Controller shared by every PDP entry point of a worker."""
+    global _CONTROLLER
+    if _CONTROLLER is None:
+        _CONTROLLER = Controller()
+    return _CONTROLLER
+
 
 def create_resource():
     """Resource factory method"""
     deserializer = Deserializer()
     serializer = Serializer()
-    return wsgi.Resource(Controller(), deserializer, serializer)
+    return wsgi.Resource(get_controller(), deserializer, serializer)
@@ -38,5 +38,34 @@ class API(wsgi.Router):
                        controller=pdp_resource,
                        action='enforce_nova',
                        conditions={'method': ['POST']})
+        mapper.connect('/pdp/{service}/{mode}',
+                       controller=pdp_resource,
+                       action='decide',
+                       requirements={'mode': 'check|enforce'},
+                       conditions={'method': ['POST']})
+        mapper.connect('/pdp/batch',
+                       controller=pdp_resource,
+                       action='batch',
+                       conditions={'method': ['POST']})
+        mapper.connect('/pdp/sessions',
+                       controller=pdp_resource,
+                       action='create_session',
+                       conditions={'method': ['POST']})
+        mapper.connect('/pdp/cache',
+                       controller=pdp_resource,
+                       action='cache_stats',
+                       conditions={'method': ['GET']})
+        mapper.connect('/pdp/{service}/permissions',
+                       controller=pdp_resource,
+                       action='permissions',
+                       conditions={'method': ['GET']})
+        mapper.connect('/pdp/{service}/analysis',
+                       controller=pdp_resource,
+                       action='analysis',
+                       conditions={'method': ['GET']})
+        mapper.connect('/pdp/{service}/snapshot',
+                       controller=pdp_resource,
+                       action='snapshot',
+                       conditions={'method': ['GET']})
 
         super(API, self).__init__(mapper)
@@ -15,8 +15,8 @@
 
 import httplib
 
-from oslo.serialization import jsonutils
 from oslo_config import cfg
+from oslo_serialization import jsonutils
 import webob.dec
 
 from sios.common import wsgi
@@ -0,0 +1,104 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process caches used on the decision path.
+
+None of the methods below yield to the eventlet hub, so a cache may be shared
+by all greenthreads of a worker without locking.
+"""
+
+import collections
+import time
+
+
+class LRUCache(object):
+    """A bounded, least-recently-used mapping whose entries may expire."""
+
+    def __init__(self, size, ttl=None):
+        """
+        :param size: Maximum number of entries kept.
+        :param ttl: Default lifetime of an entry in seconds. None or 0 keeps
+                    entries until they are evicted.
+        """
+        self.size = size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the live value cached for key, or default."""
+        data = self._data
+        try:
+            value, expires = data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if expires is not None and expires <= time.time():
+            self.expirations += 1
+            self.misses += 1
+            return default
+        data[key] = (value, expires)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value under key, evicting the least recently used entries.
+
+        :param ttl: Lifetime of this entry, overriding the default one.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl else None
+        data = self._data
+        data.pop(key, None)
+        data[key] = (value, expires)
+        while len(data) > self.size:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def items(self):
+        """Return the live (key, value) pairs, least recently used first."""
+        now = time.time()
+        return [(key, value) for key, (value, expires) in self._data.items()
+                if expires is None or expires > now]
+
+    def prune(self, predicate):
+        """Drop every entry whose key matches the predicate."""
+        data = self._data
+        for key in [key for key in data if predicate(key)]:
+            del data[key]
+
+    def clear(self):
+        """Drop every entry at once."""
+        self._data = collections.OrderedDict()
+
+    def stats(self):
+        """Return the size of the cache and its hit/miss counters."""
+        return {
+            'entries': len(self._data),
+            'size': self.size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
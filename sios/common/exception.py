@@ -104,6 +104,10 @@ class NotAuthenticated(SiosException):
     message = _("You are not authenticated.")
 
 
+class InvalidSession(NotAuthenticated):
+    message = _("Invalid PDP session: %(reason)s")
+
+
 class Forbidden(SiosException):
     message = _("You are not authorized to complete this action.")
 
@@ -0,0 +1,284 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Watch files from a greenthread and call back when they change.
+
+On Linux the watcher blocks on an inotify descriptor through the eventlet hub,
+so it costs nothing until a file changes. Elsewhere, or when inotify cannot be
+set up, it falls back to comparing the stat of the files at a fixed interval.
+
+Files are watched through their directory, which also catches editors and
+deployment tools replacing a file by renaming a new one over it.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import sys
+
+import eventlet
+from eventlet import hubs
+from eventlet import patcher
+from oslo_log import log as logging
+import six
+
+from sios import i18n
+
+_LE = i18n._LE
+_LI = i18n._LI
+
+LOG = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+               IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+               IN_MOVE_SELF)
+
+_EVENT = struct.Struct('iIII')
+
+# NOTE: The green os.read waits for the descriptor when it would block,
+# which would never return when draining the inotify queue.
+_read = patcher.original('os').read
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+    return _libc
+
+
+class _Inotify(object):
+    """Minimal inotify binding, enough to wait for changes in directories."""
+
+    def __init__(self):
+        libc = _get_libc()
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path):
+        if isinstance(path, six.text_type):
+            path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+        wd = self._add_watch(self.fd, path, _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self):
+        """Wait for events and return them as (wd, mask, name) tuples."""
+        while True:
+            hubs.trampoline(self.fd, read=True)
+            try:
+                data = _read(self.fd, 64 * 1024)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+            break
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FileWatcher(object):
+    """Call back from a greenthread whenever watched files change."""
+
+    def __init__(self, paths, callback, interval=5, delay=0.1):
+        """
+        :param paths: Files, or directories whose whole content is watched.
+        :param callback: Called without arguments after a change.
+        :param interval: Seconds between two checks when polling.
+        :param delay: Seconds to wait for a burst of changes to settle
+                      before calling back.
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.callback = callback
+        self.interval = interval
+        self.delay = delay
+        self.mode = None
+        self._thread = None
+        self._inotify = None
+        self._names = {}
+        self._signature_seen = None
+
+    def start(self):
+        """Start watching, in the current process.
+
+        The watches are in place when this returns, so any change made
+        afterwards is reported.
+        """
+        if self._thread is not None:
+            return
+        try:
+            self._setup_inotify()
+        except (AttributeError, EnvironmentError) as err:
+            # NOTE: AttributeError means the C library has no inotify.
+            self._setup_poll(err)
+        self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.kill()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def _targets(self):
+        """Map every directory to watch to the names that matter in it.
+
+        A name of None stands for any entry of the directory.
+        """
+        targets = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                targets.setdefault(path, set()).add(None)
+            else:
+                directory, name = os.path.split(path)
+                targets.setdefault(directory, set()).add(name)
+        return targets
+
+    def _setup_inotify(self):
+        self._inotify = _Inotify()
+        self._names = {}
+        for directory, wanted in self._targets().items():
+            self._names[self._inotify.add_watch(directory)] = wanted
+        self.mode = 'inotify'
+
+    def _setup_poll(self, err):
+        LOG.info(_LI('Polling %(paths)s every %(interval)s seconds, '
+                     'inotify is unavailable: %(err)s'),
+                 {'paths': ', '.join(self.paths),
+                  'interval': self.interval, 'err': err})
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._signature_seen = self._signature()
+        self.mode = 'poll'
+
+    def _run(self):
+        if self.mode == 'inotify':
+            try:
+                self._watch_inotify()
+            except EnvironmentError as err:
+                self._setup_poll(err)
+                # NOTE: A watched directory went away, which is a change.
+                self._notify()
+        self._watch_poll()
+
+    def _notify(self):
+        try:
+            self.callback()
+        except Exception:
+            LOG.exception(_LE('Failed to handle a change of %s'),
+                          ', '.join(self.paths))
+
+    def _watch_inotify(self):
+        inotify = self._inotify
+        while True:
+            if not self._is_relevant(inotify.read(), self._names):
+                continue
+            # NOTE: A file is seldom written in one go; let the burst of
+            # events settle and drain it, then reload once.
+            eventlet.sleep(self.delay)
+            self._drain(inotify)
+            self._notify()
+
+    def _is_relevant(self, events, names):
+        for wd, mask, name in events:
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                raise OSError(errno.ENOENT, 'watched directory is gone')
+            if mask & IN_Q_OVERFLOW:
+                return True
+            wanted = names.get(wd, ())
+            if None in wanted or name in wanted:
+                return True
+        return False
+
+    def _drain(self, inotify):
+        while True:
+            try:
+                _read(inotify.fd, 64 * 1024)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno == errno.EAGAIN:
+                    return
+                raise
+
+    def _signature(self):
+        signature = []
+        for path in self.paths:
+            paths = [path]
+            if os.path.isdir(path):
+                paths.extend(os.path.join(path, name)
+                             for name in sorted(os.listdir(path)))
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    signature.append((path, None))
+                else:
+                    signature.append((path, st.st_ino, st.st_size,
+                                      st.st_mtime))
+        return signature
+
+    def _watch_poll(self):
+        signature = self._signature_seen
+        while True:
+            eventlet.sleep(self.interval)
+            try:
+                current = self._signature()
+            except OSError:
+                continue
+            if current != signature:
+                signature = current
+                self._notify()
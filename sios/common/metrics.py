@@ -0,0 +1,337 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process metrics, rendered in the Prometheus text exposition format.
+
+Counters and latency histograms are kept per API worker. Histograms use
+log-linear buckets, four per power of two from about a microsecond to a
+minute, so any latency is known within 25% whatever its order of magnitude.
+
+Recording a sample does not yield to the eventlet hub, so metrics may be
+updated by all greenthreads of a worker without locking. When a shared
+directory is configured, every worker periodically writes a snapshot of its
+metrics there and a scrape of any worker reports the sum over all of them.
+Only the snapshots of live workers of the same parent process are summed.
+"""
+
+import atexit
+import bisect
+import os
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from sios import i18n
+
+_ = i18n._
+_LE = i18n._LE
+
+metrics_opts = [
+    cfg.BoolOpt('enabled', default=True,
+                help=_('Record request, decision, cache and policy reload '
+                       'metrics and serve them from the metrics path.')),
+    cfg.StrOpt('path', default='/metrics',
+               help=_('Path the metrics are served from, in the Prometheus '
+                      'text format.')),
+    cfg.StrOpt('shared_dir',
+               help=_('Directory where every API worker writes a snapshot '
+                      'of its metrics, so that the metrics served by any '
+                      'worker cover all of them. When unset, every worker '
+                      'only reports its own metrics.')),
+    cfg.IntOpt('snapshot_interval', default=10,
+               help=_('Number of seconds between two snapshots of the '
+                      'metrics of a worker in the shared directory.')),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metrics_opts, group='metrics')
+LOG = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# NOTE: Upper bounds of the histogram buckets, in seconds.
+BUCKETS = tuple(m * 2.0 ** e for e in range(-20, 6)
+                for m in (1.0, 1.25, 1.5, 1.75))
+
+_METRICS = []
+
+
+def _escape(value):
+    return (('%s' % value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(pairs)
+
+
+def _format_value(value):
+    if value == int(value):
+        return '%d' % value
+    return repr(value)
+
+
+class Counter(object):
+    """A monotonically increasing count, per set of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        _METRICS.append(self)
+
+    def inc(self, labels=(), amount=1):
+        """Increase the count of the given label values."""
+        series = self.series
+        series[labels] = series.get(labels, 0) + amount
+
+    def snapshot(self):
+        return [[list(labels), value]
+                for labels, value in self.series.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+    def render(self, series):
+        for labels, value in sorted(series.items()):
+            yield '%s%s %s' % (self.name,
+                               _format_labels(self.labels, labels),
+                               _format_value(value))
+
+
+class Histogram(object):
+    """A distribution of durations, per set of label values."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        _METRICS.append(self)
+
+    def observe(self, labels, value):
+        """Record a duration, in seconds, for the given label values."""
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(BUCKETS) + 1), 0.0]
+        series[0][bisect.bisect_left(BUCKETS, value)] += 1
+        series[1] += value
+
+    def snapshot(self):
+        return [[list(labels), [list(counts), total]]
+                for labels, (counts, total) in self.series.items()]
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return [list(value[0]), value[1]]
+        return [[a + b for a, b in zip(total[0], value[0])],
+                total[1] + value[1]]
+
+    def render(self, series):
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                yield '%s_bucket%s %d' % (
+                    self.name,
+                    _format_labels(self.labels, labels, ('le', repr(bound))),
+                    cumulative)
+            cumulative += counts[-1]
+            yield '%s_bucket%s %d' % (
+                self.name, _format_labels(self.labels, labels, ('le', '+Inf')),
+                cumulative)
+            yield '%s_sum%s %s' % (self.name,
+                                   _format_labels(self.labels, labels),
+                                   repr(total))
+            yield '%s_count%s %d' % (self.name,
+                                     _format_labels(self.labels, labels),
+                                     cumulative)
+
+
+class Timer(object):
+    """Context manager observing the time spent in its block."""
+
+    def __init__(self, histogram, labels=()):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(self.labels, time.time() - self.start)
+
+
+def snapshot():
+    """Return the metrics of this worker as a JSON serializable dict."""
+    return dict((metric.name, metric.snapshot()) for metric in _METRICS)
+
+
+def _snapshot_path(pid):
+    return os.path.join(CONF.metrics.shared_dir, 'sios-%d.json' % pid)
+
+
+def _snapshot_pid(name):
+    """Return the pid of the worker a snapshot file belongs to, if any."""
+    if not (name.startswith('sios-') and name.endswith('.json')):
+        return None
+    try:
+        return int(name[len('sios-'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _is_sibling(pid):
+    """Tell whether pid is a live worker forked by the parent of this one."""
+    try:
+        with open('/proc/%d/stat' % pid) as stat_file:
+            stat = stat_file.read()
+    except IOError:
+        return False
+    # NOTE: The parent pid follows the state, after the command name which
+    # may itself contain spaces and parentheses.
+    return int(stat.rsplit(')', 1)[1].split()[1]) == os.getppid()
+
+
+def _collect():
+    """Return the series of every metric, summed over all workers.
+
+    Snapshots left behind by workers which have exited, or written by
+    processes which are not workers of the same parent, are skipped.
+    """
+    snapshots = [snapshot()]
+    shared_dir = CONF.metrics.shared_dir
+    if shared_dir:
+        own = os.getpid()
+        for name in os.listdir(shared_dir):
+            pid = _snapshot_pid(name)
+            if pid is None or pid == own or not _is_sibling(pid):
+                continue
+            try:
+                with open(os.path.join(shared_dir, name)) as snapshot_file:
+                    snapshots.append(jsonutils.loads(snapshot_file.read()))
+            except (IOError, ValueError):
+                # NOTE: A worker may be rewriting its snapshot.
+                continue
+    collected = []
+    for metric in _METRICS:
+        series = {}
+        for worker in snapshots:
+            for labels, value in worker.get(metric.name, ()):
+                labels = tuple(labels)
+                series[labels] = metric.merge(series.get(labels), value)
+        collected.append((metric, series))
+    return collected
+
+
+def render():
+    """Return the metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric, series in _collect():
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        lines.extend(metric.render(series))
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def _write_snapshots(pid):
+    path = _snapshot_path(pid)
+    while True:
+        eventlet.sleep(CONF.metrics.snapshot_interval)
+        try:
+            data = jsonutils.dumps(snapshot())
+            with open(path + '.tmp', 'w') as snapshot_file:
+                snapshot_file.write(data)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError):
+            LOG.exception(_LE('Failed to write the metrics snapshot %s'),
+                          path)
+
+
+def _remove_snapshot(pid):
+    # NOTE: Forked processes inherit the exit handlers of their parent.
+    if pid != os.getpid():
+        return
+    try:
+        os.unlink(_snapshot_path(pid))
+    except OSError:
+        pass
+
+
+_writer_pid = None
+
+
+def start_snapshots():
+    """Start writing the snapshots of this worker, if configured.
+
+    The snapshot is removed when the worker exits.
+    """
+    global _writer_pid
+    pid = os.getpid()
+    if _writer_pid == pid or not CONF.metrics.shared_dir:
+        return
+    _writer_pid = pid
+    atexit.register(_remove_snapshot, pid)
+    eventlet.spawn_n(_write_snapshots, pid)
+
+
+PDP_DECISIONS = Counter(
+    'sios_pdp_decisions_total',
+    'Policy decisions made, by service, mode and outcome.',
+    ('service', 'mode', 'decision'))
+PDP_DECISION_SECONDS = Histogram(
+    'sios_pdp_decision_seconds',
+    'Time spent making a policy decision, cache lookup included, by '
+    'service, mode and action.',
+    ('service', 'mode', 'action'))
+PDP_CACHE = Counter(
+    'sios_pdp_cache_lookups_total',
+    'Decision cache lookups, by service and result.',
+    ('service', 'result'))
+HTTP_REQUESTS = Counter(
+    'sios_http_requests_total',
+    'API requests served, by endpoint, method and status code.',
+    ('endpoint', 'method', 'status'))
+HTTP_REQUEST_SECONDS = Histogram(
+    'sios_http_request_seconds',
+    'Time spent serving an API request, by endpoint.',
+    ('endpoint',))
+POLICY_RELOADS = Counter(
+    'sios_policy_reloads_total',
+    'Policy file reloads, by service and result.',
+    ('service', 'result'))
+POLICY_RELOAD_SECONDS = Histogram(
+    'sios_policy_reload_seconds',
+    'Time spent reloading and compiling the policy of a service.',
+    ('service',))
@@ -728,6 +728,7 @@ def stash_conf_values():
     conf['backlog'] = CONF.backlog
     conf['key_file'] = CONF.key_file
     conf['cert_file'] = CONF.cert_file
+    conf['unix_socket_mode'] = CONF.unix_socket_mode
 
     return conf
 
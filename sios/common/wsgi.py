@@ -25,6 +25,7 @@ import errno
 import functools
 import os
 import signal
+import stat
 import sys
 import time
 
@@ -33,11 +34,11 @@ from eventlet.green import socket
 from eventlet.green import ssl
 import eventlet.greenio
 import eventlet.wsgi
-from oslo.serialization import jsonutils
 from oslo_concurrency import processutils
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_log import loggers
+from oslo_serialization import jsonutils
 import routes
 import routes.middleware
 import six
@@ -61,6 +62,13 @@ bind_opts = [
                       'selecting a particular network interface.')),
     cfg.IntOpt('bind_port',
                help=_('The port on which the server will listen.')),
+    cfg.ListOpt('bind_unix_sockets', default=[],
+                help=_('Paths of Unix domain sockets the server listens on '
+                       'as well as its TCP port, for clients running on the '
+                       'same host.')),
+    cfg.StrOpt('unix_socket_mode', default='0660',
+               help=_('Permissions of the Unix domain socket files, in '
+                      'octal. Clients need write permission to connect.')),
 ]
 
 socket_opts = [
@@ -98,6 +106,17 @@ eventlet_opts = [
                        'read successfully by the client, you simply have to '
                        'set this option to False when you create a wsgi '
                        'server.')),
+    cfg.IntOpt('client_socket_timeout', default=900,
+               help=_('Timeout for client connections\' socket operations. '
+                      'If an incoming connection is idle for this number of '
+                      'seconds it will be closed. A value of \'0\' means '
+                      'wait forever.')),
+    cfg.IntOpt('max_requests_per_connection', default=0,
+               help=_('Maximum number of requests served on a persistent '
+                      'connection. The response to the last one carries '
+                      '"Connection: close", so that clients reconnect and '
+                      'their connections are spread again over the workers. '
+                      'A value of \'0\' means no limit.')),
 ]
 
 profiler_opts = [
@@ -199,6 +218,39 @@ def get_socket(default_port):
     return sock
 
 
+def get_unix_socket_mode():
+    """Return the configured permissions of the Unix domain sockets."""
+    try:
+        return int(CONF.unix_socket_mode, 8)
+    except ValueError:
+        raise RuntimeError(_("Invalid unix_socket_mode %s, it must be an "
+                             "octal number such as 0660") %
+                           CONF.unix_socket_mode)
+
+
+def get_unix_socket(path):
+    """
+    Bind a Unix domain socket to a path in conf
+
+    A socket file left behind at the path by a previous server is replaced.
+
+    :param path: path of the socket file
+
+    :returns : a socket object as returned from socket.listen
+    """
+    mode = get_unix_socket_mode()
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    sock = eventlet.listen(path, family=socket.AF_UNIX,
+                           backlog=CONF.backlog)
+    os.chmod(path, mode)
+    return sock
+
+
 def set_eventlet_hub():
     try:
         eventlet.hubs.use_hub('poll')
@@ -230,6 +282,47 @@ def get_asynchronous_eventlet_pool(size=1000):
     return pool
 
 
+class HttpProtocol(eventlet.wsgi.HttpProtocol):
+    """HTTP/1.1 protocol closing connections after a number of requests.
+
+    Requests are read from a buffered file, so clients may pipeline them on
+    a persistent connection; they are answered in order.
+    """
+
+    # NOTE: Only applies to request lines without a version.
+    default_request_version = "HTTP/1.0"
+
+    requests_served = 0
+
+    unix = False
+
+    def setup(self):
+        # NOTE: Clients of Unix domain sockets have no address. The check
+        # lives here rather than in __init__, whose arguments differ between
+        # eventlet releases.
+        if not isinstance(self.client_address, tuple) or \
+                not self.client_address:
+            self.unix = True
+            self.client_address = ('unix', 0)
+        eventlet.wsgi.HttpProtocol.setup(self)
+
+    def get_environ(self):
+        env = eventlet.wsgi.HttpProtocol.get_environ(self)
+        if self.unix:
+            env['SERVER_NAME'] = 'localhost'
+            env['SERVER_PORT'] = '80'
+        return env
+
+    def parse_request(self):
+        if not eventlet.wsgi.HttpProtocol.parse_request(self):
+            return False
+        self.requests_served += 1
+        max_requests = CONF.max_requests_per_connection
+        if max_requests and self.requests_served >= max_requests:
+            self.close_connection = 1
+        return True
+
+
 class Server(object):
     """Server class to manage multiple WSGI sockets and applications.
 
@@ -239,6 +332,7 @@ class Server(object):
         self._logger = logging.getLogger("eventlet.wsgi.server")
         self._wsgi_logger = loggers.WritableLogger(self._logger)
         self.threads = threads
+        self.unix_socks = {}
         self.children = set()
         self.stale_children = set()
         self.running = True
@@ -290,6 +384,10 @@ class Server(object):
             # Useful for profiling, test, debug etc.
             self.pool = self.create_pool()
             self.pool.spawn_n(self._single_run, self.application, self.sock)
+            # NOTE: Outside of the pool, which each server waits on when
+            # it stops.
+            for sock in self.unix_socks.values():
+                eventlet.spawn_n(self._single_run, self.application, sock)
             return
         else:
             LOG.info(_LI("Starting %d workers") % CONF.workers)
@@ -344,6 +442,8 @@ class Server(object):
                 continue
         eventlet.greenio.shutdown_safe(self.sock)
         self.sock.close()
+        for path in list(self.unix_socks):
+            self.close_unix_socket(path)
         LOG.debug('Exited')
 
     def configure(self, old_conf=None, has_changed=None):
@@ -354,7 +454,9 @@ class Server(object):
         :param has changed: callable to determine if a parameter has changed
         """
         eventlet.wsgi.MAX_HEADER_LINE = CONF.max_header_line
+        self.client_socket_timeout = CONF.client_socket_timeout or None
         self.configure_socket(old_conf, has_changed)
+        self.configure_unix_sockets(has_changed)
 
     def reload(self):
         """
@@ -400,6 +502,8 @@ class Server(object):
             signal.signal(signal.SIGHUP, signal.SIG_IGN)
             eventlet.wsgi.is_accepting = False
             self.sock.close()
+            for sock in self.unix_socks.values():
+                sock.close()
 
         pid = os.fork()
         if pid == 0:
@@ -428,31 +532,41 @@ class Server(object):
             utils.setup_remote_pydev_debug(cfg.CONF.pydev_worker_debug_host,
                                            cfg.CONF.pydev_worker_debug_port)
 
-        eventlet.wsgi.HttpProtocol.default_request_version = "HTTP/1.0"
         self.pool = self.create_pool()
+        unix_servers = [eventlet.spawn(self._serve, sock)
+                        for sock in self.unix_socks.values()]
+        self._serve(self.sock)
+        for server in unix_servers:
+            server.wait()
+
+        # waiting on async pools
+        if ASYNC_EVENTLET_THREAD_POOL_LIST:
+            for pool in ASYNC_EVENTLET_THREAD_POOL_LIST:
+                pool.waitall()
+
+    def _serve(self, sock):
         try:
-            eventlet.wsgi.server(self.sock,
+            eventlet.wsgi.server(sock,
                                  self.application,
                                  log=self._wsgi_logger,
                                  custom_pool=self.pool,
                                  debug=False,
-                                 keepalive=CONF.http_keepalive)
+                                 keepalive=CONF.http_keepalive,
+                                 protocol=HttpProtocol,
+                                 socket_timeout=self.client_socket_timeout)
         except socket.error as err:
             if err[0] != errno.EINVAL:
                 raise
 
-        # waiting on async pools
-        if ASYNC_EVENTLET_THREAD_POOL_LIST:
-            for pool in ASYNC_EVENTLET_THREAD_POOL_LIST:
-                pool.waitall()
-
     def _single_run(self, application, sock):
         """Start a WSGI server in a new green thread."""
         LOG.info(_LI("Starting single process server"))
         eventlet.wsgi.server(sock, application, custom_pool=self.pool,
                              log=self._wsgi_logger,
                              debug=False,
-                             keepalive=CONF.http_keepalive)
+                             keepalive=CONF.http_keepalive,
+                             protocol=HttpProtocol,
+                             socket_timeout=self.client_socket_timeout)
 
     def configure_socket(self, old_conf=None, has_changed=None):
         """
@@ -527,6 +641,40 @@ class Server(object):
             self.sock.listen(CONF.backlog)
 
 
+    def configure_unix_sockets(self, has_changed=None):
+        """
+        Ensure the configured Unix domain sockets exist.
+
+        Like the TCP socket, a socket is kept across a configuration reload
+        unless its path is no longer configured, in which case it is closed
+        and its file removed.
+
+        :param has changed: callable to determine if a parameter has changed
+        """
+        paths = CONF.bind_unix_sockets
+        for path in list(self.unix_socks):
+            if path not in paths:
+                self.close_unix_socket(path)
+        for path in paths:
+            sock = self.unix_socks.get(path)
+            if sock is None:
+                self.unix_socks[path] = get_unix_socket(path)
+                continue
+            if has_changed('unix_socket_mode'):
+                os.chmod(path, get_unix_socket_mode())
+            if has_changed('backlog'):
+                sock.listen(CONF.backlog)
+
+    def close_unix_socket(self, path):
+        """Close a Unix domain socket and remove its file."""
+        self.unix_socks.pop(path).close()
+        try:
+            os.unlink(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
 class Middleware(object):
     """
     Base WSGI middleware wrapper. These classes require an application to be
@@ -34,7 +34,10 @@ class RequestContext(context.RequestContext):
         self.roles = roles or []
         self.owner_is_tenant = owner_is_tenant
         self.service_catalog = service_catalog
-        self.policy_enforcer = policy_enforcer or policy.Enforcer()
+        self.policy_enforcer = policy_enforcer or policy.get_enforcer()
+        # NOTE: Outcomes of named policy rules for these credentials, shared
+        # by every decision made during the request.
+        self.policy_memo = {}
 	self.action = action
 	self.target = target
         if not self.is_admin:
@@ -0,0 +1,80 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+
+from sios.common import metrics
+
+CONF = cfg.CONF
+
+LABELS = ('test', 'single', 'allow')
+
+
+class TestSharedSnapshots(unittest.TestCase):
+    """Scrapes sum the snapshots of the live workers only."""
+
+    def setUp(self):
+        super(TestSharedSnapshots, self).setUp()
+        CONF([], project='sios')
+        self.addCleanup(CONF.reset)
+        self.shared_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.shared_dir)
+        CONF.set_override('shared_dir', self.shared_dir, group='metrics')
+        # NOTE: This process stands for the parent of the workers, so the
+        # processes it starts are seen as workers alongside this one.
+        getppid = os.getppid
+        os.getppid = os.getpid
+        self.addCleanup(setattr, os, 'getppid', getppid)
+
+    def _worker(self):
+        worker = subprocess.Popen(['sleep', '60'])
+        self.addCleanup(worker.wait)
+        self.addCleanup(worker.kill)
+        return worker.pid
+
+    def _write(self, pid, count):
+        snapshot = {metrics.PDP_DECISIONS.name: [[list(LABELS), count]]}
+        with open(metrics._snapshot_path(pid), 'w') as snapshot_file:
+            snapshot_file.write(jsonutils.dumps(snapshot))
+
+    def _decisions(self):
+        for metric, series in metrics._collect():
+            if metric is metrics.PDP_DECISIONS:
+                return series.get(LABELS)
+
+    def test_sum_of_live_workers(self):
+        metrics.PDP_DECISIONS.inc(LABELS)
+        self.addCleanup(metrics.PDP_DECISIONS.series.pop, LABELS)
+        self._write(self._worker(), 2)
+        self._write(self._worker(), 3)
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        self._write(dead.pid, 100)
+        # NOTE: Snapshot of this worker itself, which is read from memory.
+        self._write(os.getpid(), 100)
+        self.assertEqual(6, self._decisions())
+
+    def test_snapshot_removed_at_exit(self):
+        pid = os.getpid()
+        self._write(pid, 1)
+        metrics._remove_snapshot(pid)
+        self.assertFalse(os.path.exists(metrics._snapshot_path(pid)))
@@ -0,0 +1,112 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from oslo_config import cfg
+from oslo_policy import policy as oslo_policy
+from oslo_serialization import jsonutils
+import routes
+import webob
+
+# NOTE: Registers the oslo.policy options sios.api.policy relies on, as the
+# API entry point does before loading the application.
+from sios.common import config  # noqa
+from sios.api.middleware import context
+from sios.api import policy
+from sios.api.v1 import router
+
+CONF = cfg.CONF
+
+RULES = {
+    'default': 'role:admin',
+    'public': '@',
+    'owner': 'tenant:%(project_id)s',
+    'user_owner': 'user:%(user_id)s or rule:admin',
+    'admin': 'role:admin',
+    'nested': "'active':%(status)s and rule:owner",
+}
+
+TARGETS = [
+    {},
+    {'project_id': 'tenant1'},
+    {'project_id': 'tenant2', 'user_id': 'user1'},
+    {'project_id': 'tenant1', 'status': 'active'},
+    {'project_id': 'tenant1', 'status': 'deleted', 'extra': [1, 2]},
+]
+
+
+class TestDecisionTargets(unittest.TestCase):
+    """Single and batched decisions evaluate the same targets."""
+
+    def setUp(self):
+        super(TestDecisionTargets, self).setUp()
+        CONF([], project='sios')
+        CONF.set_override('service_policy_files',
+                          {'nova': 'policy_nova.json'})
+        CONF.set_override('size', 0, group='decision_cache')
+        self.addCleanup(CONF.reset)
+        policy._ENFORCERS.clear()
+        self.addCleanup(policy._ENFORCERS.clear)
+        policy.get_enforcer('nova').set_rules(
+            oslo_policy.Rules.from_dict(RULES))
+        self.app = context.ContextMiddleware(router.API(routes.Mapper()))
+
+    def _request(self, path, roles='member', **headers):
+        req = webob.Request.blank(path, method='POST')
+        req.headers.update({
+            'X-Identity-Status': 'Confirmed',
+            'X-User-Id': 'user1',
+            'X-Tenant-Id': 'tenant1',
+            'X-Roles': roles,
+            'X-Auth-Token': 'token',
+        })
+        req.headers.update(headers)
+        return req
+
+    def _single(self, action, target):
+        req = self._request('/pdp/nova/enforce', **{
+            'X-Action': action, 'X-Target': jsonutils.dumps(target)})
+        res = req.get_response(self.app)
+        self.assertEqual(200, res.status_int)
+        return jsonutils.loads(res.body)
+
+    def _batch(self, checks):
+        req = self._request('/pdp/batch')
+        req.content_type = 'application/json'
+        req.body = jsonutils.dumps({'items': [
+            {'service': 'nova', 'action': action, 'target': target}
+            for action, target in checks]})
+        res = req.get_response(self.app)
+        self.assertEqual(200, res.status_int)
+        return jsonutils.loads(res.body)['decisions']
+
+    def test_single_matches_batch(self):
+        checks = [(action, target) for action in sorted(RULES) + ['unknown']
+                  for target in TARGETS]
+        batched = self._batch(checks)
+        for (action, target), decision in zip(checks, batched):
+            self.assertEqual(decision, self._single(action, target),
+                             '%s on %s' % (action, target))
+
+    def test_target_is_decoded(self):
+        self.assertTrue(self._single('owner', {'project_id': 'tenant1'}))
+        self.assertFalse(self._single('owner', {'project_id': 'tenant2'}))
+
+    def test_legacy_target_is_passed_on(self):
+        req = self._request('/pdp/nova/enforce',
+                            **{'X-Target': "{'project_id': 'tenant1'}"})
+        self.assertEqual("{'project_id': 'tenant1'}",
+                         context.get_target(req))
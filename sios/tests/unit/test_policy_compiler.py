@@ -0,0 +1,274 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from oslo_config import cfg
+from oslo_policy import policy as oslo_policy
+from oslo_serialization import jsonutils
+
+# NOTE: Registers the oslo.policy options sios.api.policy relies on, as the
+# API entry point does before loading the application.
+from sios.common import config  # noqa
+from sios.api import policy
+from sios.api import policy_compiler
+
+CONF = cfg.CONF
+
+ETC_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'etc')
+POLICY_FILES = ('policy_nova.json', 'policy_glance.json')
+
+CREDENTIALS = [
+    {'roles': roles, 'user': user, 'tenant': tenant}
+    for roles in ([], ['admin'], ['Member'], ['admin', 'member'])
+    for user, tenant in (('user1', 'tenant1'), ('user2', 'tenant2'))
+] + [
+    {'roles': ['member'], 'user': 'user1', 'tenant': 'tenant1',
+     'is_admin': True},
+    {'user': 'user1', 'tenant': 'tenant1'},
+]
+
+TARGETS = [
+    {},
+    {'project_id': 'tenant1'},
+    {'project_id': 'tenant2', 'user_id': 'user1'},
+    {'project_id': 'tenant1', 'status': 'active', 'role': 'member'},
+    'not a dict',
+]
+
+# NOTE: Rule strings the reload tests build rule sets from. A rule only
+# refers to rules of a higher number, so the rule sets have no cycles.
+RULE_STRINGS = [
+    '@',
+    '!',
+    '',
+    'role:admin',
+    'role:member',
+    'role:admin or role:member',
+    'not role:admin',
+    'tenant:%(project_id)s',
+    'user:%(user_id)s or rule:rule%(ref)d',
+    "'active':%(status)s and rule:rule%(ref)d",
+    'rule:rule%(ref)d',
+    'rule:rule%(ref)d or role:member',
+    'not rule:rule%(ref)d',
+]
+RULES = 8
+
+
+class Enforcer(object):
+    """Stands for the enforcer handed to checks."""
+
+    def __init__(self, rules):
+        self.rules = rules
+
+
+def interpret(rules, action, target, creds):
+    """Decide the way oslo.policy's Enforcer.enforce does."""
+    if not rules:
+        return False
+    try:
+        return rules[action](target, creds, Enforcer(rules))
+    except KeyError:
+        return False
+
+
+def outcome(func):
+    try:
+        return func()
+    except Exception as exc:
+        return type(exc)
+
+
+class TestCompiledRules(unittest.TestCase):
+    """The compiled engine decides what the interpreter decides."""
+
+    def setUp(self):
+        super(TestCompiledRules, self).setUp()
+        CONF([], project='sios')
+        self.addCleanup(CONF.reset)
+
+    def _load(self, name, default_rule='default'):
+        with open(os.path.join(ETC_DIR, name)) as policy_file:
+            return oslo_policy.Rules.load_json(policy_file.read(),
+                                               default_rule)
+
+    def _assert_same_decisions(self, rules, compiled, actions):
+        enforcer = Enforcer(rules)
+        for creds in CREDENTIALS:
+            memo = {}
+            for target, action in itertools.product(TARGETS, actions):
+                expected = outcome(
+                    lambda: interpret(rules, action, target, creds))
+                # NOTE: Twice, the second time from the memo and the
+                # decision matrix.
+                for _ in range(2):
+                    actual = outcome(lambda: compiled.enforce(
+                        action, target, creds, enforcer, memo=memo))
+                    self.assertEqual(expected, actual,
+                                     (action, target, creds))
+
+    def test_policy_files(self):
+        for name, default_rule, role_sets in itertools.product(
+                POLICY_FILES, ('default', None, 'context_is_admin'),
+                (0, 4)):
+            rules = self._load(name, default_rule)
+            compiled = policy_compiler.CompiledRules(rules,
+                                                     role_sets=role_sets)
+            actions = sorted(rules) + ['no_such_action']
+            self._assert_same_decisions(rules, compiled, actions)
+
+    def test_kinds(self):
+        rules = oslo_policy.Rules.from_dict({
+            'default': '!',
+            'always': '@ or role:admin',
+            'never': '! and role:admin',
+            'admin': 'role:admin and @',
+            'is_admin': 'is_admin:True',
+            'owner': 'tenant:%(project_id)s',
+            'not_owner': 'not rule:owner',
+        }, 'default')
+        compiled = policy_compiler.CompiledRules(rules, role_sets=4)
+        self.assertEqual({
+            'default': policy_compiler.CONSTANT,
+            'always': policy_compiler.CONSTANT,
+            'never': policy_compiler.CONSTANT,
+            'admin': policy_compiler.ROLE,
+            'is_admin': policy_compiler.CREDENTIALS,
+            'owner': policy_compiler.CONDITIONAL,
+            'not_owner': policy_compiler.CONDITIONAL,
+        }, compiled.kinds)
+        self.assertEqual(set(['default', 'always', 'never', 'admin']),
+                         set(compiled.columns))
+        self._assert_same_decisions(rules, compiled, sorted(rules))
+
+    def test_incremental_compile(self):
+        rules = self._load('policy_nova.json')
+        previous = policy_compiler.CompiledRules(rules, role_sets=4)
+        self._assert_same_decisions(rules, previous, ['admin_api'])
+        raw = dict((name, str(rule)) for name, rule in rules.items())
+        raw['admin_api'] = 'role:admin'
+        raw['context_is_admin'] = '!'
+        del raw['compute:create']
+        rules = oslo_policy.Rules.from_dict(raw, 'default')
+        compiled = policy_compiler.CompiledRules(
+            rules, role_sets=4, previous=previous,
+            changed=set(['admin_api', 'context_is_admin', 'compute:create']))
+        self.assertIn('compute_extension:accounts', compiled.affected)
+        self.assertNotIn('compute:get_all', compiled.affected)
+        self._assert_same_decisions(rules, compiled,
+                                    sorted(rules) + ['compute:create'])
+
+
+class TestReload(unittest.TestCase):
+    """Every decision changed by a reload is reported by changed_since."""
+
+    def setUp(self):
+        super(TestReload, self).setUp()
+        self.config_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.config_dir)
+        self.path = os.path.join(self.config_dir, 'policy_nova.json')
+        CONF(['--config-dir', self.config_dir], project='sios')
+        self.addCleanup(CONF.reset)
+        CONF.set_override('service_policy_files',
+                          {'nova': 'policy_nova.json'})
+        CONF.set_override('policy_file_watcher', False)
+        self.random = random.Random(42)
+
+    def _write(self, raw):
+        with open(self.path, 'w') as policy_file:
+            policy_file.write(jsonutils.dumps(raw))
+
+    def _decisions(self, enforcer, actions, interpreted=False):
+        compiled = None if interpreted else enforcer._compiled
+        decisions = {}
+        for creds, target, action in itertools.product(
+                CREDENTIALS, TARGETS, actions):
+            if compiled is not None:
+                decide = lambda: compiled.enforce(action, target, creds,
+                                                  enforcer)
+            else:
+                decide = lambda: interpret(enforcer.rules, action, target,
+                                           creds)
+            decisions[(action, repr(creds), repr(target))] = outcome(decide)
+        return decisions
+
+    def _rule(self, number):
+        """Return a rule string for rule<number>, or for the default rule.
+
+        References may name rule<RULES>, which never exists and resolves to
+        the default rule.
+        """
+        if number is None:
+            return self.random.choice([rule for rule in RULE_STRINGS
+                                       if '%(ref)d' not in rule])
+        rule = self.random.choice(RULE_STRINGS)
+        ref = self.random.randint(number + 1, RULES)
+        return rule.replace('%(ref)d', str(ref))
+
+    def _edit(self, raw):
+        raw = dict(raw)
+        for _ in range(self.random.randint(1, 3)):
+            number = self.random.randint(0, RULES - 1)
+            name = 'rule%d' % number
+            if self.random.random() < 0.1:
+                raw['default'] = self._rule(None)
+            elif name in raw and self.random.random() < 0.2:
+                del raw[name]
+            else:
+                raw[name] = self._rule(number)
+        return raw
+
+    def _check_reloads(self, engine):
+        CONF.set_override('policy_engine', engine)
+        raw = dict(('rule%d' % i, self._rule(i)) for i in range(RULES))
+        raw['default'] = self._rule(None)
+        self._write(raw)
+        enforcer = policy.Enforcer('nova')
+        enforcer.load_rules()
+        enforcer._load_policy()
+        reported = 0
+        for _ in range(100):
+            version = enforcer.version
+            new_raw = self._edit(raw)
+            actions = sorted(set(raw) | set(new_raw)) + ['no_such_action']
+            before = self._decisions(enforcer, actions)
+            self._write(new_raw)
+            enforcer._load_policy()
+            after = self._decisions(enforcer, actions)
+            # NOTE: Rules compiled again from their previous version decide
+            # what the rules loaded from scratch decide.
+            self.assertEqual(
+                self._decisions(enforcer, actions, interpreted=True), after)
+            changed = enforcer.changed_since(version)
+            if changed is not None:
+                reported += 1
+                for key, decision in after.items():
+                    if before[key] != decision:
+                        self.assertIn(key[0], changed, (raw, new_raw, key))
+            raw = new_raw
+        # NOTE: Only edits of the default rule change every decision.
+        self.assertTrue(reported)
+
+    def test_interpreted(self):
+        self._check_reloads('interpreted')
+
+    def test_compiled(self):
+        self._check_reloads('compiled')
@@ -0,0 +1,136 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import imp
+import itertools
+import os
+import unittest
+
+from oslo_config import cfg
+from oslo_policy import policy as oslo_policy
+from oslo_serialization import jsonutils
+
+# NOTE: Registers the oslo.policy options sios.api.policy relies on, as the
+# API entry point does before loading the application.
+from sios.common import config  # noqa
+from sios.api import policy
+from sios.common import exception
+from sios import context
+
+CONF = cfg.CONF
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+
+# NOTE: The client of the policy shims is installed in the services, not
+# in SIOS, so it is loaded from its file.
+sios_client = imp.load_source(
+    'sios_client', os.path.join(ROOT_DIR, 'external_service_policy_files',
+                                'sios_client.py'))
+
+RULES = {
+    'default': 'rule:admin_or_owner',
+    'admin': 'role:admin',
+    'admin_or_owner': 'rule:admin or project_id:%(project_id)s',
+    'owner': 'tenant:%(project_id)s',
+    'user_owner': 'user:%(user_id)s and not role:observer',
+    'nested': "'active':%(status)s and (rule:owner or role:Member)",
+    'numbers': '1:%(count)s or True:%(enabled)s',
+    'public': '@',
+    'nobody': '!',
+    'missing': 'rule:no_such_rule',
+    'remote': 'role:admin or http://localhost:1/%(project_id)s',
+}
+
+CONTEXTS = [
+    dict(roles=roles, user=user, tenant=tenant)
+    for roles in ([], ['admin'], ['member'], ['Member', 'observer'])
+    for user, tenant in (('user1', 'tenant1'), ('user2', 'tenant2'))
+]
+
+TARGETS = [
+    {},
+    {'project_id': 'tenant1'},
+    {'project_id': 'tenant2', 'user_id': 'user1'},
+    {'project_id': 'tenant1', 'status': 'active'},
+    {'count': 1, 'enabled': True},
+    {'count': '1', 'enabled': 'False', 'status': None},
+]
+
+
+class TestLocalPolicy(unittest.TestCase):
+    """Snapshots evaluated by the shims decide what SIOS decides."""
+
+    def setUp(self):
+        super(TestLocalPolicy, self).setUp()
+        CONF([], project='sios')
+        CONF.set_override('service_policy_files',
+                          {'nova': 'policy_nova.json'})
+        self.addCleanup(CONF.reset)
+        policy._ENFORCERS.clear()
+        self.addCleanup(policy._ENFORCERS.clear)
+        self.enforcer = policy.get_enforcer('nova')
+
+    def _local(self):
+        # NOTE: As downloaded by the shims.
+        snapshot = jsonutils.loads(jsonutils.dumps(self.enforcer.snapshot()))
+        return sios_client.LocalPolicy(snapshot)
+
+    def _assert_same_decisions(self, actions):
+        local = self._local()
+        unsupported = set()
+        for values, target, action in itertools.product(
+                CONTEXTS, TARGETS, actions):
+            # NOTE: Targets reach SIOS and the shims as JSON.
+            target = jsonutils.loads(jsonutils.dumps(target))
+            ctx = context.RequestContext(**values)
+            try:
+                local_decision = local.decide(
+                    action, target, self.enforcer._credentials(ctx))
+            except sios_client.Unsupported:
+                unsupported.add(action)
+                continue
+            try:
+                decision = bool(self.enforcer.enforce(ctx, action, target))
+            except exception.Forbidden:
+                decision = False
+            self.assertEqual(decision, local_decision,
+                             (action, target, values))
+        return unsupported
+
+    def test_rules(self):
+        self.enforcer.set_rules(oslo_policy.Rules.from_dict(RULES))
+        unsupported = self._assert_same_decisions(
+            sorted(RULES) + ['no_such_action'])
+        # NOTE: Only SIOS makes http checks, unless the decision is known
+        # before reaching one.
+        self.assertEqual(set(['remote']), unsupported)
+
+    def test_policy_files(self):
+        for name in ('policy_nova.json', 'policy_glance.json'):
+            with open(os.path.join(ROOT_DIR, 'etc', name)) as policy_file:
+                rules = oslo_policy.Rules.load_json(policy_file.read())
+            self.enforcer.set_rules(rules)
+            unsupported = self._assert_same_decisions(
+                sorted(rules) + ['no_such_action'])
+            self.assertEqual(set(), unsupported)
+
+    def test_version(self):
+        self.enforcer.set_rules(oslo_policy.Rules.from_dict(RULES))
+        version = self._local().version
+        self.enforcer.set_rules(oslo_policy.Rules.from_dict(RULES))
+        self.assertEqual(version, self._local().version)
+        rules = dict(RULES, admin='role:Admin or role:root')
+        self.enforcer.set_rules(oslo_policy.Rules.from_dict(rules))
+        self.assertNotEqual(version, self._local().version)
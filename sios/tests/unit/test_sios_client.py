@@ -0,0 +1,148 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import imp
+import os
+import time
+import unittest
+
+import eventlet
+from oslo_config import cfg
+
+CONF = cfg.CONF
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+
+# NOTE: The client of the policy shims is installed in the services, not
+# in SIOS, so it is loaded from its file.
+sios_client = imp.load_source(
+    'sios_client', os.path.join(ROOT_DIR, 'external_service_policy_files',
+                                'sios_client.py'))
+
+# NOTE: Options of the client registered by the policy.py of the shims.
+CONF.register_opts([
+    cfg.StrOpt('auth_admin_prefix', default=''),
+    cfg.StrOpt('sios_auth_host', default='127.0.0.1'),
+    cfg.IntOpt('sios_auth_port', default=5253),
+    cfg.StrOpt('sios_unix_socket', default=None),
+    cfg.StrOpt('auth_protocol', default='http'),
+    cfg.StrOpt('certfile'),
+    cfg.StrOpt('keyfile'),
+], group='authtoken')
+
+
+class FakeKeystone(object):
+    """Hands out tokens expiring a given number of seconds after a fetch."""
+
+    def __init__(self, lifetime, failures=0):
+        self.lifetime = lifetime
+        self.failures = failures
+        self.fetches = []
+
+    def fetch(self):
+        self.fetches.append(time.time())
+        if self.failures:
+            self.failures -= 1
+            raise sios_client.ServiceError('keystone is down')
+        expiry = (datetime.datetime.utcnow() +
+                  datetime.timedelta(seconds=self.lifetime))
+        return 'token%d' % len(self.fetches), expiry
+
+
+class TestTokenManager(unittest.TestCase):
+    """Admin tokens are fetched on first use and refreshed before expiry."""
+
+    def _manager(self, keystone, margin, retry_delay=0.1):
+        manager = sios_client.TokenManager(keystone.fetch, margin,
+                                           retry_delay)
+        self.addCleanup(lambda: manager.refresher and
+                        manager.refresher.kill())
+        return manager
+
+    def test_first_get_waits(self):
+        keystone = FakeKeystone(3600)
+        manager = self._manager(keystone, 300)
+        self.assertEqual('token1', manager.get())
+        self.assertEqual('token1', manager.get())
+        self.assertEqual(1, len(keystone.fetches))
+
+    def test_refresh_before_expiry(self):
+        keystone = FakeKeystone(10)
+        # NOTE: Refreshed at the earliest a second after the fetch.
+        manager = self._manager(keystone, 9)
+        self.assertEqual('token1', manager.get())
+        expires = manager.expires
+        eventlet.sleep(1.5)
+        self.assertEqual(2, len(keystone.fetches))
+        self.assertTrue(keystone.fetches[1] < expires - 8)
+        self.assertEqual('token2', manager.get())
+        self.assertEqual(2, len(keystone.fetches))
+
+    def test_failed_fetch(self):
+        keystone = FakeKeystone(3600, failures=1)
+        manager = self._manager(keystone, 300)
+        self.assertRaises(sios_client.ServiceError, manager.get)
+        self.assertEqual('token2', manager.get())
+
+    def test_failed_refresh_is_retried(self):
+        keystone = FakeKeystone(10)
+        manager = self._manager(keystone, 9, retry_delay=1)
+        manager.get()
+        keystone.failures = 1
+        eventlet.sleep(1.5)
+        # NOTE: The token in use stays valid while the refresh is retried.
+        self.assertEqual('token1', manager.get())
+        self.assertEqual(2, len(keystone.fetches))
+        eventlet.sleep(1)
+        self.assertEqual(3, len(keystone.fetches))
+        self.assertEqual('token3', manager.get())
+
+
+class TestSnapshotToken(unittest.TestCase):
+    """Policy snapshots are downloaded with the token of the service."""
+
+    def setUp(self):
+        super(TestSnapshotToken, self).setUp()
+        CONF([], project='sios')
+        self.addCleanup(CONF.reset)
+        CONF.set_override('sios_health_check_interval', 0,
+                          group='authtoken')
+        self.addCleanup(sios_client._token_sources.clear)
+        self.client = sios_client.Client(CONF.authtoken)
+
+    def test_caller_token(self):
+        self.assertEqual('caller', self.client._snapshot_token('nova',
+                                                               'caller'))
+
+    def test_admin_token(self):
+        keystone = FakeKeystone(3600)
+        sios_client.set_token_source(
+            'nova', lambda: self.client.admin_token('keystone',
+                                                    keystone.fetch))
+        self.addCleanup(
+            lambda: self.client.token_managers['keystone'].refresher.kill())
+        self.assertEqual('token1', self.client._snapshot_token('nova',
+                                                               'caller'))
+        self.assertEqual('caller', self.client._snapshot_token('glance',
+                                                               'caller'))
+
+    def test_failed_admin_token(self):
+        keystone = FakeKeystone(3600, failures=1)
+        sios_client.set_token_source(
+            'nova', lambda: self.client.admin_token('keystone',
+                                                    keystone.fetch))
+        self.assertEqual('caller', self.client._snapshot_token('nova',
+                                                               'caller'))
@@ -0,0 +1,90 @@
+# Copyright 2015 OpenStack Foundation
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import eventlet
+from oslo_config import cfg
+
+from sios.common import config  # noqa
+from sios.common import wsgi
+
+CONF = cfg.CONF
+
+REQUEST = 'GET /ping HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+def application(env, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['%s:%s' % (env['SERVER_NAME'], env['SERVER_PORT'])]
+
+
+class TestServe(unittest.TestCase):
+    """Requests are served through Server._serve with HttpProtocol."""
+
+    def setUp(self):
+        super(TestServe, self).setUp()
+        CONF([], project='sios')
+        self.addCleanup(CONF.reset)
+        umask = os.umask(0)
+        os.umask(umask)
+        self.addCleanup(os.umask, umask)
+        self.server = wsgi.Server(threads=4)
+        self.server.application = application
+        self.server.pool = self.server.create_pool()
+        self.server.client_socket_timeout = 5
+
+    def _start(self, sock):
+        thread = eventlet.spawn(self.server._serve, sock)
+        self.addCleanup(thread.kill)
+
+    def _exchange(self, client, data):
+        client.sendall(data)
+        response = ''
+        with eventlet.Timeout(5):
+            while True:
+                chunk = client.recv(4096)
+                if not chunk:
+                    return response
+                response += chunk
+
+    def test_tcp(self):
+        CONF.set_override('max_requests_per_connection', 1)
+        sock = eventlet.listen(('127.0.0.1', 0))
+        self._start(sock)
+        client = eventlet.connect(sock.getsockname())
+        self.addCleanup(client.close)
+        # NOTE: Only the first of two pipelined requests is answered, the
+        # connection is closed after it.
+        response = self._exchange(client, REQUEST * 2)
+        self.assertEqual(1, response.count('HTTP/1.1 200 OK'))
+        self.assertTrue(response.endswith('127.0.0.1:%d' %
+                                          sock.getsockname()[1]))
+
+    def test_unix(self):
+        CONF.set_override('max_requests_per_connection', 2)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'sios.sock')
+        self._start(wsgi.get_unix_socket(path))
+        client = eventlet.connect(path, family=socket.AF_UNIX)
+        self.addCleanup(client.close)
+        response = self._exchange(client, REQUEST * 3)
+        self.assertEqual(2, response.count('HTTP/1.1 200 OK'))
+        self.assertEqual(2, response.count('localhost:80'))